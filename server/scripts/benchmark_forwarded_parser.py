@@ -0,0 +1,80 @@
+import sys
+import json
+import time
+from pathlib import Path
+
+# Run from the server directory: python scripts/benchmark_forwarded_parser.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.services.email.parser import parse_forwarded_email
+
+CORPUS_DIR = Path(__file__).resolve().parent / "corpus" / "forwarded"
+MIN_SECONDS = 2.0
+
+def load_corpus():
+    """Load the forwarded/quoted message samples and their expected headers."""
+    expected = json.loads((CORPUS_DIR / "expected.json").read_text(encoding="utf-8"))
+    samples = {
+        name: (CORPUS_DIR / name).read_text(encoding="utf-8")
+        for name in sorted(expected)
+    }
+    return samples, expected
+
+def check_corpus(samples, expected):
+    """Verify the parser still extracts the expected headers from every sample."""
+    failures = 0
+    for name, body in samples.items():
+        result = parse_forwarded_email(body)
+        actual = {"is_forwarded": result["is_forwarded"], **{
+            field: result["original"][field] for field in ("from", "to", "cc", "subject", "date")
+        }}
+        if actual != expected[name]:
+            failures += 1
+            print(f"MISMATCH {name}")
+            print(f"  expected: {expected[name]}")
+            print(f"  actual:   {actual}")
+    return failures
+
+def measure(bodies, min_seconds=MIN_SECONDS):
+    """Parse the bodies repeatedly for at least min_seconds and return messages per second."""
+    parsed = 0
+    start = time.perf_counter()
+    while True:
+        for body in bodies:
+            parse_forwarded_email(body)
+        parsed += len(bodies)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return parsed / elapsed
+
+def time_once(body):
+    start = time.perf_counter()
+    parse_forwarded_email(body)
+    return time.perf_counter() - start
+
+def pathological_inputs(size):
+    """Inputs that made the previous regex-per-field parser backtrack."""
+    return {
+        "dash line": "-" * size,
+        "repeated labels": "-----Original Message-----\n" + "From: To: Cc: Sent: " * (size // 20),
+        "whitespace headers": "-----Original Message-----\nFrom:" + " " * size + "\n",
+        "no marker": "Hello world. " * (size // 13),
+    }
+
+if __name__ == "__main__":
+    samples, expected = load_corpus()
+    failures = check_corpus(samples, expected)
+    print(f"Corpus check: {len(samples) - failures}/{len(samples)} samples match")
+
+    rate = measure(list(samples.values()))
+    print(f"Corpus throughput: {rate:,.0f} messages/s")
+
+    # Quadrupling the input should roughly quadruple the time for a linear-time parser
+    small, large = 100_000, 400_000
+    for (name, small_body), large_body in zip(pathological_inputs(small).items(),
+                                              pathological_inputs(large).values()):
+        small_time, large_time = time_once(small_body), time_once(large_body)
+        print(f"{name:>20}: {small_time * 1000:8.2f} ms @ {small:,} chars, "
+              f"{large_time * 1000:8.2f} ms @ {large:,} chars (x{large_time / max(small_time, 1e-9):.1f})")
+
+    sys.exit(1 if failures else 0)
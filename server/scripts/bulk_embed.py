@@ -0,0 +1,42 @@
+import sys
+import time
+import asyncio
+import argparse
+from pathlib import Path
+
+# Run from the server directory: python scripts/bulk_embed.py email alice@example.com bob@example.com
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.process.drive.preprocess import embed_drive
+from src.process.email.preprocess import embed_email
+from src.services.database.bulk import bulk_ingest
+from src.services.database.elastic import get_es_client, init_elastic, return_drive, return_email
+
+async def bulk_embed(index: str, user_emails: list):
+    """Embed the backed-up data of newly onboarded users with the index in bulk ingest mode."""
+    # Restores the settings of an earlier load that was cut short
+    await init_elastic()
+    es_client = await get_es_client()
+    vector_store = await (return_email() if index == "email" else return_drive())
+    embed = embed_email if index == "email" else embed_drive
+    try:
+        start = time.perf_counter()
+        # One load for all users, so the index is tuned and restored once
+        async with bulk_ingest(es_client, index):
+            for user_email in user_emails:
+                user_start = time.perf_counter()
+                await embed(vector_store, user_email, bulk=True)
+                print(f"Embedded {index} data of {user_email} in {time.perf_counter() - user_start:.1f}s")
+        print(f"Embedded {len(user_emails)} users in {time.perf_counter() - start:.1f}s")
+    finally:
+        await es_client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Embed users' backups in bulk ingest mode. Searches of every user of the index "
+                    "miss new documents until the load ends, so run it for onboarding, off-peak."
+    )
+    parser.add_argument("index", choices=["email", "drive"])
+    parser.add_argument("user_emails", nargs="+")
+    args = parser.parse_args()
+    asyncio.run(bulk_embed(args.index, args.user_emails))
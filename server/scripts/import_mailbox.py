@@ -0,0 +1,30 @@
+import sys
+import time
+import asyncio
+import argparse
+from pathlib import Path
+
+# Run from the server directory: python scripts/import_mailbox.py user@example.com ~/Takeout/Mail
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.services.email.storage import EmailStorage
+
+async def import_mailbox(user_email: str, path: Path, workers: int = None):
+    """Import an mbox/EML archive offline and report the ingestion rate."""
+    start = time.perf_counter()
+    with EmailStorage(user_email) as storage:
+        result = await storage.import_archive(path, workers=workers)
+    elapsed = time.perf_counter() - start
+
+    print(f"Imported {result['messages_imported']:,} messages into {result['threads_imported']:,} threads "
+          f"({result['messages_failed']:,} failed) in {elapsed:.1f}s")
+    print(f"Throughput: {result['messages_imported'] / max(elapsed, 1e-9):,.0f} messages/s")
+    print(f"Data written to {result['data_path']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a local mbox/EML archive for a user")
+    parser.add_argument("user_email")
+    parser.add_argument("path", type=Path, help=".mbox file, .eml file or a directory of them")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU cores)")
+    args = parser.parse_args()
+    asyncio.run(import_mailbox(args.user_email, args.path, args.workers))
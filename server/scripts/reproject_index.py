@@ -0,0 +1,70 @@
+import sys
+import time
+import asyncio
+import argparse
+from pathlib import Path
+
+# Run from the server directory: python scripts/reproject_index.py email --dimensions 512
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from elasticsearch import AsyncElasticsearch
+
+from src.config.settings import get_settings
+from src.services.database.indices import concrete_index, index_dimensions
+from src.services.database.reproject import copy_reprojected, measure_recall, swap_alias
+from src.services.embeddings.reduced import supports_reduction
+
+async def reproject_index(index: str, dims: int, sample_size: int, k: int, min_recall: float):
+    """Re-project an index to shorter vectors, report the recall cost and swap it in.
+
+    At the index's current size this only copies it into the current
+    mappings, e.g. for an index created before they were explicit.
+    """
+    settings = get_settings()
+    es_client = AsyncElasticsearch(
+        [settings.elastic_url],
+        basic_auth=(settings.elastic_username, settings.elastic_password),
+        verify_certs=False,
+        request_timeout=60
+    )
+    try:
+        source = await concrete_index(es_client, index)
+        source_dims = await index_dimensions(es_client, source) if source else None
+        model = settings.local_embedding_model if settings.embedding_backend == "local" else settings.openai_embedding_model
+        if source_dims and dims < source_dims and not supports_reduction(model):
+            print(f"{model} is not trained for shortened vectors; only text-embedding-3 models are")
+            return 1
+
+        start = time.perf_counter()
+        result = await copy_reprojected(es_client, index, dims)
+        print(f"Copied {result['documents']:,} documents from {result['source']} ({result['source_dims']} dims) "
+              f"to {result['target']} ({dims} dims) in {time.perf_counter() - start:.1f}s")
+
+        recall = await measure_recall(es_client, result["source"], result["target"], dims, sample_size, k)
+        print(f"Recall@{k} against exact search on the full vectors: {recall:.3f} ({sample_size} sampled queries)")
+        if recall < min_recall:
+            await es_client.indices.delete(index=result["target"])
+            print(f"Recall is below {min_recall:.3f}; deleted {result['target']} and kept {result['source']}")
+            return 1
+
+        await swap_alias(es_client, index, result["source"], result["target"], dims)
+        print(f"{index} now points to {result['target']}; {result['source']} was deleted")
+        print(f"Set {index.upper()}_EMBEDDING_DIMENSIONS={dims} before restarting the server")
+        return 0
+    finally:
+        await es_client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shorten the vectors of an existing index")
+    parser.add_argument("index", choices=["email", "drive"])
+    parser.add_argument("--dimensions", type=int, default=None,
+                        help="target vector size (default: <INDEX>_EMBEDDING_DIMENSIONS)")
+    parser.add_argument("--sample", type=int, default=100, help="queries used to measure recall")
+    parser.add_argument("--k", type=int, default=10, help="neighbours compared per query")
+    parser.add_argument("--min-recall", type=float, default=0.0,
+                        help="keep the current index when recall@k falls below this")
+    args = parser.parse_args()
+    dims = args.dimensions or getattr(get_settings(), f"{args.index}_embedding_dimensions")
+    if not dims:
+        parser.error("no target size; pass --dimensions or set the index's EMBEDDING_DIMENSIONS setting")
+    sys.exit(asyncio.run(reproject_index(args.index, dims, args.sample, args.k, args.min_recall)))
@@ -12,6 +12,18 @@ GMAIL_API_BASE = "https://www.googleapis.com/gmail/v1/users/me"
 GMAIL_MESSAGES_URL = f"{GMAIL_API_BASE}/messages"
 GMAIL_LABELS_URL = f"{GMAIL_API_BASE}/labels"
 
+# Document types the embedding pipeline can convert to text
+SUPPORTED_DOCUMENT_EXTENSIONS = [".pdf", ".docx", ".txt", ".xls", ".xlsx", ".ppt", ".pptx"]
+SUPPORTED_DOCUMENT_MIME_TYPES = [
+    "application/pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "text/plain",
+    "application/vnd.ms-excel",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "application/vnd.ms-powerpoint",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+]
+
 # Google Drive API
 DRIVE_API_BASE = "https://www.googleapis.com/drive/v3"
 DRIVE_FILES_URL = f"{DRIVE_API_BASE}/files"
@@ -26,9 +26,79 @@ class Settings(BaseSettings):
     elastic_url: str = os.getenv('ELASTIC_URI')
     elastic_username: str = os.getenv('ELASTIC_USERNAME')
     elastic_password: str = os.getenv('ELASTIC_PASSWORD')
-    
-    
-    
+
+    # Email backup settings
+    email_backup_concurrency: int = int(os.getenv('EMAIL_BACKUP_CONCURRENCY', '8'))
+    email_backup_global_concurrency: int = int(os.getenv('EMAIL_BACKUP_GLOBAL_CONCURRENCY', '32'))
+    email_backup_page_size: int = int(os.getenv('EMAIL_BACKUP_PAGE_SIZE', '500'))
+    email_backup_progress_interval: int = int(os.getenv('EMAIL_BACKUP_PROGRESS_INTERVAL', '100'))
+    # "concurrent" fetches each thread/attachment on its own, "batch" groups them into Gmail batch requests
+    email_ingest_mode: str = os.getenv('EMAIL_INGEST_MODE', 'concurrent')
+    email_batch_size: int = int(os.getenv('EMAIL_BATCH_SIZE', '50'))
+    email_batch_max_retries: int = int(os.getenv('EMAIL_BATCH_MAX_RETRIES', '3'))
+    # Attachments prefetched in batch mode are held in memory until stored; cap their total decoded size
+    email_batch_attachment_bytes: int = int(os.getenv('EMAIL_BATCH_ATTACHMENT_BYTES', str(64 * 1024 * 1024)))
+    # Attachment fetch policy; empty lists fall back to the supported document types
+    email_attachment_extensions: str = os.getenv('EMAIL_ATTACHMENT_EXTENSIONS', '')
+    email_attachment_mime_types: str = os.getenv('EMAIL_ATTACHMENT_MIME_TYPES', '')
+    email_attachment_max_bytes: int = int(os.getenv('EMAIL_ATTACHMENT_MAX_BYTES', str(25 * 1024 * 1024)))
+    # Base64 characters decoded at a time when writing attachments to disk
+    email_attachment_decode_chunk_size: int = int(os.getenv('EMAIL_ATTACHMENT_DECODE_CHUNK_SIZE', str(1024 * 1024)))
+    # Offline mbox/EML import; 0 workers means one per CPU core
+    email_import_workers: int = int(os.getenv('EMAIL_IMPORT_WORKERS', '0'))
+    email_import_batch_size: int = int(os.getenv('EMAIL_IMPORT_BATCH_SIZE', '64'))
+    # The import route only reads archives inside this directory
+    email_import_root: str = os.getenv('EMAIL_IMPORT_ROOT', 'data/imports')
+
+    # Drive folder traversal: folder listings in flight per setup; a max depth of -1 walks the whole tree
+    drive_traversal_concurrency: int = int(os.getenv('DRIVE_TRAVERSAL_CONCURRENCY', '8'))
+    drive_traversal_max_depth: int = int(os.getenv('DRIVE_TRAVERSAL_MAX_DEPTH', '-1'))
+    # Sibling folders listed with one query, OR-ing up to this many parents within this many characters
+    drive_query_max_parents: int = int(os.getenv('DRIVE_QUERY_MAX_PARENTS', '50'))
+    drive_query_max_length: int = int(os.getenv('DRIVE_QUERY_MAX_LENGTH', '4000'))
+    drive_list_page_size: int = int(os.getenv('DRIVE_LIST_PAGE_SIZE', '1000'))
+
+    # Embedding settings; a batch is embedded and indexed once either limit is reached
+    embedding_batch_size: int = int(os.getenv('EMBEDDING_BATCH_SIZE', '100'))
+    embedding_batch_max_tokens: int = int(os.getenv('EMBEDDING_BATCH_MAX_TOKENS', '100000'))
+    # Texts are split into chunks of this many tokens, overlapping by embedding_chunk_overlap
+    embedding_chunk_tokens: int = int(os.getenv('EMBEDDING_CHUNK_TOKENS', '512'))
+    embedding_chunk_overlap: int = int(os.getenv('EMBEDDING_CHUNK_OVERLAP', '64'))
+    # "openai" or "local" (a sentence-transformers model run on this machine)
+    embedding_backend: str = os.getenv('EMBEDDING_BACKEND', 'openai')
+    openai_embedding_model: str = os.getenv('OPENAI_EMBEDDING_MODEL', 'text-embedding-3-small')
+    local_embedding_model: str = os.getenv('LOCAL_EMBEDDING_MODEL', 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
+    local_embedding_device: str = os.getenv('LOCAL_EMBEDDING_DEVICE', 'cpu')
+    # Concurrent requests are merged into batches of up to this many texts, waiting at most max_wait_ms
+    local_embedding_batch_size: int = int(os.getenv('LOCAL_EMBEDDING_BATCH_SIZE', '32'))
+    local_embedding_max_wait_ms: int = int(os.getenv('LOCAL_EMBEDDING_MAX_WAIT_MS', '10'))
+    # Torch threads used for inference; 0 keeps the torch default
+    local_embedding_threads: int = int(os.getenv('LOCAL_EMBEDDING_THREADS', '4'))
+    # Vector size stored per index; 0 keeps the model's full output, smaller values shorten it
+    email_embedding_dimensions: int = int(os.getenv('EMAIL_EMBEDDING_DIMENSIONS', '0'))
+    drive_embedding_dimensions: int = int(os.getenv('DRIVE_EMBEDDING_DIMENSIONS', '0'))
+    # Quota shared by all OpenAI embedding calls; 0 disables a budget
+    embedding_requests_per_minute: int = int(os.getenv('EMBEDDING_REQUESTS_PER_MINUTE', '3000'))
+    embedding_tokens_per_minute: int = int(os.getenv('EMBEDDING_TOKENS_PER_MINUTE', '1000000'))
+    # Upper bound of the adaptive number of concurrent embedding requests
+    embedding_max_concurrency: int = int(os.getenv('EMBEDDING_MAX_CONCURRENCY', '8'))
+    embedding_max_retries: int = int(os.getenv('EMBEDDING_MAX_RETRIES', '6'))
+    # Local cache of computed embeddings; 0 entries disables it
+    embedding_cache_path: str = os.getenv('EMBEDDING_CACHE_PATH', 'data/embedding_cache.db')
+    embedding_cache_max_entries: int = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '200000'))
+    # Vector field of the email/drive indices: "hnsw", "int8_hnsw" or "bbq_hnsw" (Elasticsearch 8.16+)
+    elastic_vector_index_type: str = os.getenv('ELASTIC_VECTOR_INDEX_TYPE', 'int8_hnsw')
+    elastic_hnsw_m: int = int(os.getenv('ELASTIC_HNSW_M', '16'))
+    elastic_hnsw_ef_construction: int = int(os.getenv('ELASTIC_HNSW_EF_CONSTRUCTION', '100'))
+    # Bulk ingest mode: documents per bulk request, bulk requests in flight, force-merge when done
+    elastic_bulk_chunk_size: int = int(os.getenv('ELASTIC_BULK_CHUNK_SIZE', '500'))
+    elastic_bulk_concurrency: int = int(os.getenv('ELASTIC_BULK_CONCURRENCY', '4'))
+    elastic_bulk_force_merge: bool = os.getenv('ELASTIC_BULK_FORCE_MERGE', 'false').lower() == 'true'
+    # Document conversion pool; 0 workers means one per CPU core, 0 MB means no memory limit
+    conversion_workers: int = int(os.getenv('CONVERSION_WORKERS', '0'))
+    conversion_timeout: int = int(os.getenv('CONVERSION_TIMEOUT', '120'))
+    conversion_memory_limit_mb: int = int(os.getenv('CONVERSION_MEMORY_LIMIT_MB', '2048'))
+
     # Application settings
     frontend_url: str = os.getenv('NEXTAUTH_URL', 'http://localhost:3000')
 
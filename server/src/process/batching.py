@@ -0,0 +1,116 @@
+import asyncio
+from collections import deque
+from typing import Callable, Deque, List, Optional, Tuple
+from uuid import uuid4
+
+from elasticsearch import AsyncElasticsearch
+from langchain_core.documents import Document
+from langchain_elasticsearch import AsyncElasticsearchStore
+
+from src.config.settings import get_settings
+from src.process.tokens import count_tokens
+from src.services.database.bulk import bulk_index
+
+class EmbeddingBatcher:
+    """Groups documents into batched embedding requests and bulk index writes.
+
+    Documents are buffered until ``max_documents`` or ``max_tokens`` is
+    reached, then embedded with one request and indexed with one bulk
+    write. A batch is indexed while the next one is being embedded, with at
+    most one index write in flight. ``on_indexed`` callbacks run once the
+    document they were added with is stored, always in the order the
+    documents were added.
+
+    Given ``es_client`` and ``index`` (bulk ingest mode, see
+    ``src.services.database.bulk``), batches are written with the bulk
+    helper directly and up to ``elastic_bulk_concurrency`` writes are in
+    flight at once.
+
+    Use as an async context manager so the last batch is flushed::
+
+        async with EmbeddingBatcher(vector_store) as batcher:
+            await batcher.add(document)
+    """
+
+    def __init__(self, vector_store: AsyncElasticsearchStore, max_documents: Optional[int] = None,
+                 max_tokens: Optional[int] = None, es_client: Optional[AsyncElasticsearch] = None,
+                 index: Optional[str] = None):
+        settings = get_settings()
+        self.vector_store = vector_store
+        self.max_documents = max_documents or settings.embedding_batch_size
+        self.max_tokens = max_tokens or settings.embedding_batch_max_tokens
+        self.es_client = es_client
+        self.index = index
+        self.bulk = es_client is not None and index is not None
+        self.max_in_flight = max(1, settings.elastic_bulk_concurrency) if self.bulk else 1
+        self._documents: List[Document] = []
+        self._ids: List[str] = []
+        self._callbacks: List[Callable[[], None]] = []
+        self._tokens = 0
+        # Index writes in flight, oldest first, with the callbacks of their documents
+        self._indexing: Deque[Tuple[asyncio.Task, List[Callable[[], None]]]] = deque()
+
+    async def __aenter__(self) -> "EmbeddingBatcher":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            await self.flush()
+            while self._indexing:
+                await self._wait_for_index()
+        elif self._indexing:
+            # Already failing; let the writes finish without masking the original error
+            await asyncio.gather(*(task for task, _ in self._indexing), return_exceptions=True)
+            self._indexing.clear()
+
+    async def add(self, document: Document, doc_id: Optional[str] = None,
+                  on_indexed: Optional[Callable[[], None]] = None) -> None:
+        """Queue a document, flushing first if it would overflow the current batch."""
+        tokens = count_tokens(document.page_content)
+        if self._documents and self._tokens + tokens > self.max_tokens:
+            await self.flush()
+
+        self._documents.append(document)
+        self._ids.append(doc_id or str(uuid4()))
+        if on_indexed is not None:
+            self._callbacks.append(on_indexed)
+        self._tokens += tokens
+
+        if len(self._documents) >= self.max_documents or self._tokens >= self.max_tokens:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Embed the buffered documents and start writing them to the index."""
+        if not self._documents:
+            return
+        documents, ids, callbacks = self._documents, self._ids, self._callbacks
+        self._documents, self._ids, self._callbacks, self._tokens = [], [], [], 0
+
+        texts = [document.page_content for document in documents]
+        # Earlier batches are still being indexed while this one is embedded
+        embeddings = await self.vector_store.embeddings.aembed_documents(texts)
+        while len(self._indexing) >= self.max_in_flight:
+            await self._wait_for_index()
+        task = asyncio.create_task(
+            self._index(texts, embeddings, [document.metadata for document in documents], ids))
+        self._indexing.append((task, callbacks))
+
+    async def _index(self, texts: List[str], embeddings: List[List[float]], metadatas: List[dict],
+                     ids: List[str]) -> None:
+        if self.bulk:
+            await bulk_index(self.es_client, self.index, texts, embeddings, metadatas, ids)
+            return
+        await self.vector_store.aadd_embeddings(
+            text_embeddings=list(zip(texts, embeddings)),
+            metadatas=metadatas,
+            ids=ids,
+            refresh_indices=False
+        )
+
+    async def _wait_for_index(self) -> None:
+        """Wait for the oldest write in flight, then run the callbacks of its documents."""
+        if self._indexing:
+            task, callbacks = self._indexing.popleft()
+            await task
+            for callback in callbacks:
+                callback()
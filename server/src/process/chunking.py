@@ -0,0 +1,66 @@
+from typing import Dict, List, NamedTuple, Optional
+
+from langchain_core.documents import Document
+
+from src.config.settings import get_settings
+from src.process.tokens import get_encoding
+
+class Chunk(NamedTuple):
+    text: str
+    start: int
+    end: int
+
+def chunk_text(text: str, chunk_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None) -> List[Chunk]:
+    """Split a text into windows of ``chunk_tokens`` tokens overlapping by ``overlap_tokens``.
+
+    ``start`` and ``end`` are character offsets of each chunk in ``text``.
+    Texts that fit into one window come back as a single chunk; empty texts
+    give no chunks.
+    """
+    settings = get_settings()
+    chunk_tokens = chunk_tokens or settings.embedding_chunk_tokens
+    overlap_tokens = settings.embedding_chunk_overlap if overlap_tokens is None else overlap_tokens
+    if overlap_tokens >= chunk_tokens:
+        raise ValueError("Chunk overlap must be smaller than the chunk size")
+
+    if not text or not text.strip():
+        return []
+
+    encoding = get_encoding()
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= chunk_tokens:
+        return [Chunk(text, 0, len(text))]
+
+    # Character offset of every token, so chunks are cut from the text itself
+    text, offsets = encoding.decode_with_offsets(tokens)
+    offsets.append(len(text))
+
+    chunks = []
+    step = chunk_tokens - overlap_tokens
+    for token_start in range(0, len(tokens), step):
+        token_end = min(token_start + chunk_tokens, len(tokens))
+        start, end = offsets[token_start], offsets[token_end]
+        if end > start:
+            chunks.append(Chunk(text[start:end], start, end))
+        if token_end == len(tokens):
+            break
+    return chunks
+
+def chunk_documents(text: str, metadata: Dict, chunk_tokens: Optional[int] = None,
+                    overlap_tokens: Optional[int] = None, chunks: Optional[List[Chunk]] = None) -> List[Document]:
+    """Split a text into documents that carry ``metadata`` and their chunk position.
+
+    ``chunks`` can pass boundaries computed earlier for the same text.
+    """
+    if chunks is None:
+        chunks = chunk_text(text, chunk_tokens, overlap_tokens)
+    return [
+        Document(page_content=chunk.text, metadata={
+            **metadata,
+            "chunk_index": index,
+            "chunk_count": len(chunks),
+            "chunk_start": chunk.start,
+            "chunk_end": chunk.end,
+        })
+        for index, chunk in enumerate(chunks)
+    ]
@@ -0,0 +1,206 @@
+import os
+import json
+import signal
+import asyncio
+import resource
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple
+
+from src.config.settings import get_settings
+from src.process.extracted import file_digest, load_extracted_text, save_extracted_text
+
+# Extra time the parent waits beyond the worker's own alarm before giving up on it
+TIMEOUT_GRACE_SECONDS = 10
+
+# MarkItDown instance of a worker process, created by _init_worker
+_worker_md = None
+
+class ConversionTimeout(Exception):
+    pass
+
+def _raise_timeout(signum, frame):
+    raise ConversionTimeout()
+
+def _init_worker(memory_limit: int) -> None:
+    global _worker_md
+    if memory_limit:
+        # A file that needs more memory fails with MemoryError instead of taking the host down
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    signal.signal(signal.SIGALRM, _raise_timeout)
+    from markitdown import MarkItDown
+    _worker_md = MarkItDown(enable_plugins=False)
+
+def _convert(path: str, timeout: int) -> str:
+    signal.alarm(timeout)
+    try:
+        return _worker_md.convert(path).text_content or ""
+    finally:
+        signal.alarm(0)
+
+class ConversionFailureLog:
+    """Files that could not be converted, kept as JSON lines so they are not retried until they change."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._failed = set()
+        if path.exists():
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._failed.add((entry["path"], entry["size"], entry["mtime"]))
+
+    @staticmethod
+    def _key(path: str) -> Tuple[str, int, float]:
+        stat = os.stat(path)
+        return path, stat.st_size, stat.st_mtime
+
+    def __contains__(self, path: str) -> bool:
+        return self._key(path) in self._failed
+
+    def record(self, path: str, error: str) -> None:
+        key = self._key(path)
+        self._failed.add(key)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "path": key[0],
+                "size": key[1],
+                "mtime": key[2],
+                "error": error,
+                "failed_at": datetime.utcnow().isoformat(),
+            }, ensure_ascii=False) + "\n")
+
+class DocumentConverter:
+    """Converts documents to text with MarkItDown on a bounded process pool.
+
+    Conversion never runs on the event loop. Every file gets ``timeout``
+    seconds, enforced with SIGALRM in the worker and again by the caller,
+    and each worker's address space is capped at ``memory_limit`` bytes.
+    A worker that hangs or dies takes down only its pool, which is
+    replaced for the next file.
+    """
+
+    def __init__(self, workers: int, timeout: int, memory_limit: int):
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        # Files only start their timeout once a worker is free for them
+        self._slots = asyncio.Semaphore(workers)
+
+    def _new_pool(self, workers: int) -> ProcessPoolExecutor:
+        # Spawned, not forked: a fresh interpreter does not inherit the server's threads, clients
+        # and (with the local backend) torch, so the memory limit bounds the conversion alone
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker, initargs=(self.memory_limit,))
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = self._new_pool(self.workers)
+            return self._pool
+
+    def _reset_pool(self, pool: ProcessPoolExecutor) -> None:
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        # A stuck worker never returns, so its processes are killed rather than awaited
+        for process in list((pool._processes or {}).values()):
+            process.kill()
+        # Work still queued on the pool fails with BrokenProcessPool and is retried
+        pool.shutdown(wait=False)
+
+    async def convert(self, path: str, failures: Optional[ConversionFailureLog] = None,
+                      digest: Optional[str] = None) -> Optional[str]:
+        """Return the text of a document, or None when it could not be converted.
+
+        Text extracted earlier from the same content (``digest``, computed
+        when not given) by the same converter version is read from the
+        file's sidecar instead of converting again.
+        """
+        if failures is not None and path in failures:
+            return None
+        digest = digest or await asyncio.to_thread(file_digest, path)
+        cached = await asyncio.to_thread(load_extracted_text, path, digest)
+        if cached is not None:
+            return cached
+        text = await self._convert_in_pool(path, failures)
+        if text is not None:
+            await asyncio.to_thread(save_extracted_text, path, digest, text)
+        return text
+
+    async def _convert_in_pool(self, path: str, failures: Optional[ConversionFailureLog]) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        # A pool breaks for every file on it when one worker dies, so after a broken
+        # pool the file is retried on a pool of its own before it is blamed
+        for attempt in range(2):
+            pool = self._get_pool() if attempt == 0 else self._new_pool(1)
+            try:
+                async with self._slots:
+                    return await asyncio.wait_for(loop.run_in_executor(pool, _convert, path, self.timeout),
+                                                  self.timeout + TIMEOUT_GRACE_SECONDS)
+            except ConversionTimeout:
+                error = f"timed out after {self.timeout}s"
+            except asyncio.TimeoutError:
+                error = f"timed out after {self.timeout}s and did not respond to the alarm"
+                self._reset_pool(pool)
+            except BrokenProcessPool:
+                error = "worker process died"
+                self._reset_pool(pool)
+                if attempt == 0:
+                    continue
+            except MemoryError:
+                error = f"exceeded the {self.memory_limit // (1024 * 1024)} MB memory limit"
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            finally:
+                if attempt == 1:
+                    self._reset_pool(pool)
+            break
+
+        print(f"Conversion failed for {path}: {error}")
+        if failures is not None:
+            failures.record(path, error)
+        return None
+
+    async def convert_many(self, paths: Iterable[str], failures: Optional[ConversionFailureLog] = None,
+                           digests: Optional[Dict[str, str]] = None) -> AsyncIterator[Tuple[str, Optional[str]]]:
+        """Convert documents concurrently on the pool, yielding (path, text) in input order."""
+        digests = digests or {}
+        window = self.workers * 2
+        pending = deque()
+        try:
+            for path in paths:
+                pending.append((path, asyncio.ensure_future(self.convert(path, failures, digests.get(path)))))
+                if len(pending) >= window:
+                    path, task = pending.popleft()
+                    yield path, await task
+            while pending:
+                path, task = pending.popleft()
+                yield path, await task
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+_converter: Optional[DocumentConverter] = None
+_converter_lock = threading.Lock()
+
+def get_document_converter() -> DocumentConverter:
+    """The converter shared by every ingestion, so the pool bounds conversion across users."""
+    global _converter
+    with _converter_lock:
+        if _converter is None:
+            settings = get_settings()
+            _converter = DocumentConverter(
+                workers=settings.conversion_workers or os.cpu_count() or 1,
+                timeout=settings.conversion_timeout,
+                memory_limit=settings.conversion_memory_limit_mb * 1024 * 1024
+            )
+        return _converter
@@ -1,6 +1,7 @@
 
 from typing import *
 from uuid import uuid4
+from contextlib import nullcontext
 
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
@@ -14,40 +15,133 @@ from langchain_community.llms.vllm import VLLM
 from langchain_core.documents import Document
 import json
 import os
-from markitdown import MarkItDown
+import asyncio
 import uvicorn
 from pathlib import Path
+from src.config.constants import SUPPORTED_DOCUMENT_EXTENSIONS
+from src.process.batching import EmbeddingBatcher
+from src.process.chunking import chunk_documents
+from src.process.conversion import ConversionFailureLog, get_document_converter
+from src.process.extracted import cached_chunks, file_digest, is_sidecar
+from src.process.ids import document_id
+from src.services.database.bulk import bulk_ingest
+from src.services.database.elastic import get_es_client
 
 
             
             
-async def embed_drive(vector_store:AsyncElasticsearchStore,  user_id:str):
+DRIVE_INDEX = "drive"
+
+def _file_query(user_id:str, file_path:str) -> Dict:
+    return {
+        "bool": {
+            "filter": [
+                {"term": {"metadata.user_id": user_id}},
+                {"term": {"metadata.file_path": file_path}},
+            ]
+        }
+    }
+
+async def _indexed_revisions(es_client, user_id:str) -> Dict[str, str]:
+    """Revision of every file of a user in the index, keyed by file path.
+
+    Read with one paged composite aggregation instead of a search per file.
+    A file whose documents disagree or predate revisions maps to "", which
+    never matches a content hash, so it is embedded again.
+    """
+    revisions = {}
+    after = None
+    while True:
+        composite = {
+            "size": 1000,
+            "sources": [
+                {"file_path": {"terms": {"field": "metadata.file_path"}}},
+                {"revision": {"terms": {"field": "metadata.revision", "missing_bucket": True}}},
+            ],
+        }
+        if after:
+            composite["after"] = after
+        res = await es_client.search(
+            index=DRIVE_INDEX,
+            query={"term": {"metadata.user_id": user_id}},
+            size=0,
+            aggs={"files": {"composite": composite}},
+        )
+        buckets = res["aggregations"]["files"]["buckets"]
+        for bucket in buckets:
+            file_path, revision = bucket["key"]["file_path"], bucket["key"]["revision"] or ""
+            revisions[file_path] = revision if revisions.get(file_path, revision) == revision else ""
+        after = res["aggregations"]["files"].get("after_key")
+        if not buckets or not after:
+            return revisions
+
+async def embed_drive(vector_store:AsyncElasticsearchStore,  user_id:str, bulk:bool=False):
+    """Embed a user's Drive files.
+
+    Document IDs are derived from the file's path in the Drive folder and
+    the chunk index, and every document records the file's content hash as
+    its revision. Unchanged files are skipped, and a changed file has its
+    old documents deleted before it is embedded again. With ``bulk``, meant
+    for operator-run onboarding (scripts/bulk_embed.py), the index is put in
+    bulk ingest mode and batches are written with parallel bulk requests.
+    """
     try:
         root = os.path.join(os.environ["ROOT_LOCATION"], "data", user_id, "drive")
         list_all_files = []
         for r, dirs, files in os.walk(root):
             for file in files:
+                if is_sidecar(file):
+                    # extracted text cached next to a file, not a Drive file itself
+                    continue
                 list_all_files.append(os.path.join(r, file))
-        md = MarkItDown(enable_plugins=False)
-        for file in list_all_files:
-            metadata = {
-                "user_id": user_id,
-                "file_path": Path(file).as_posix(),
-                "file_name": os.path.basename(file),
-                "file_type": os.path.splitext(file)[1],
-                "data_source": "drive",
-            }
-            if os.path.splitext(file)[1] not in [".pdf", ".docx", ".txt",".xls",".xlsx",".ppt",".pptx"]:
-                print("File type not supported for file{}".format(file))
-                continue
-            res = md.convert(os.path.join(root, file))
-            if not res.text_content or res.text_content == "" or res.text_content is None:
-                print("No content in file")
-            else:
-                document = Document(page_content=res.text_content, metadata=metadata)
-                uuid = str(uuid4())
-                await vector_store.aadd_documents(documents=[document], ids=[uuid])
+        es_client = await get_es_client()
+        indexed_revisions = await _indexed_revisions(es_client, user_id)
+        # Files are split into token-sized chunks, which are embedded and indexed in batches
+        ingest = bulk_ingest(es_client, DRIVE_INDEX) if bulk else nullcontext()
+        async with ingest, EmbeddingBatcher(vector_store, es_client=es_client if bulk else None,
+                                            index=DRIVE_INDEX) as batcher:
+            to_convert = {}
+            for file in list_all_files:
+                if os.path.splitext(file)[1].lower() not in SUPPORTED_DOCUMENT_EXTENSIONS:
+                    print("File type not supported for file{}".format(file))
+                    continue
+                file_path = Path(file).as_posix()
+                # Hashing reads the whole file, so it runs off the event loop
+                revision = await asyncio.to_thread(file_digest, file)
+                indexed_revision = indexed_revisions.get(file_path)
+                if indexed_revision == revision:
+                    continue
+                if indexed_revision is not None:
+                    # the file changed; its old chunks may outnumber the new ones
+                    await es_client.delete_by_query(
+                        index=DRIVE_INDEX, query=_file_query(user_id, file_path), refresh=True
+                    )
+                to_convert[os.path.join(root, file)] = {
+                    "user_id": user_id,
+                    "file_path": file_path,
+                    "file_name": os.path.basename(file),
+                    "file_type": os.path.splitext(file)[1],
+                    "revision": revision,
+                    "data_source": "drive",
+                }
+
+            # Files are converted on the shared conversion pool, several at a time
+            failures = ConversionFailureLog(Path(root).parent / "conversion_failures.jsonl")
+            # The revision is the file's content hash, so it doubles as the extracted-text cache key
+            digests = {file: metadata["revision"] for file, metadata in to_convert.items()}
+            async for file, text_content in get_document_converter().convert_many(to_convert, failures, digests):
+                if text_content is None:
+                    # recorded as a conversion failure, retried once the file changes
+                    continue
+                if not text_content:
+                    print("No content in file")
+                else:
+                    metadata = to_convert[file]
+                    relative_path = Path(file).relative_to(root).as_posix()
+                    chunks = cached_chunks(file, text_content)
+                    for index, document in enumerate(chunk_documents(text_content, metadata, chunks=chunks)):
+                        await batcher.add(document, doc_id=document_id("drive", user_id, relative_path, index))
 
     except Exception as e:
         print(e)
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
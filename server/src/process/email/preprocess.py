@@ -1,83 +1,272 @@
-from datetime import datetime
 from typing import *
-from uuid import uuid4
+from contextlib import nullcontext
 from fastapi import HTTPException
-from langchain_core.documents import Document
-import json
 import os
-from markitdown import MarkItDown
+from pathlib import Path
 from langchain_elasticsearch import AsyncElasticsearchStore
+from src.config.constants import SUPPORTED_DOCUMENT_EXTENSIONS
+from src.process.batching import EmbeddingBatcher
+from src.process.chunking import Chunk, chunk_documents
+from src.process.conversion import ConversionFailureLog, get_document_converter
+from src.process.extracted import cached_chunks
+from src.process.ids import document_id
+from src.services.database.bulk import bulk_ingest
+from src.services.database.elastic import get_es_client
+from src.services.email.catalog import EmailCatalog, parse_received_time
+from src.services.email.parser import strip_quoted_text
 
-async def embed_email(vector_store:AsyncElasticsearchStore,  user_id:str):
+EMAIL_INDEX = "email"
+
+# Values per terms query when deleting documents of many attachments
+DELETE_TERMS_CHUNK = 1000
+
+def _message_documents(user_id:str, field:str, values:List[str]) -> Dict:
+    """Query for a user's message documents whose ``field`` is one of ``values``; attachment documents are shared."""
+    return {
+        "bool": {
+            "filter": [
+                {"term": {"metadata.user_id": user_id}},
+                {"terms": {f"metadata.{field}": values}},
+            ],
+            "must_not": [
+                {"exists": {"field": "metadata.attachment_hash"}},
+            ],
+        }
+    }
+
+def _attachment_documents(user_id:str, hashes:List[str]) -> Dict:
+    return {
+        "bool": {
+            "filter": [
+                {"term": {"metadata.user_id": user_id}},
+                {"terms": {"metadata.attachment_hash": hashes}},
+            ]
+        }
+    }
+
+async def embed_email(vector_store:AsyncElasticsearchStore,  user_id:str, conversation_ids:Optional[Iterable[str]]=None,
+                      bulk:bool=False):
+    """Embed a user's emails that are not embedded yet, or only those of the given conversations.
+
+    Conversations are streamed from the email catalog and each message is
+    marked as embedded once indexed. Attachments are content-addressed, so
+    each unique attachment is converted and embedded once and lists every
+    conversation and message carrying it. Bodies and attachments are split
+    into token-sized chunks, which are embedded and indexed in batches.
+    Quoted replies and signatures are stripped from bodies before chunking,
+    with the thread's already embedded messages as context.
+    Document IDs are derived from the conversation, message order and chunk
+    (or the attachment hash and chunk), so embedding again overwrites them;
+    the old documents of a changed message or a re-embedded attachment are
+    deleted first, since it may now have fewer chunks.
+    With ``bulk``, meant for operator-run onboarding (scripts/bulk_embed.py),
+    the index is put in bulk ingest mode and batches are written with
+    parallel bulk requests.
+    """
     try:
-        root_attachment_file_loc = os.path.join(os.environ["ROOT_LOCATION"], "data", user_id)
-        json_loc = os.path.join(os.environ["ROOT_LOCATION"], "data", user_id, "emails", "email_conversations.json")
-        
-        md = MarkItDown(enable_plugins=False)
-        with open(json_loc, "r", encoding='UTF8') as f:
-            data = json.load(f)
-
-        for email in data:
-            conversation_id = email.get("ConversationID")
-            topic = email.get("Topic")
-            for message in email.get("Messages"):
-                received_time = message.get("ReceivedTime")
-                # remove whatever is in the brackets
-                received_time = received_time[0:10] + received_time[15:]
-                parsed_date = (
-                    datetime.strptime(received_time, "%Y-%m-%d %H:%M:%S (UTC%z)")
-                    if received_time
-                    else None
-                )
-                metadata = {
-                    "from": message.get("SenderName"),
-                    "to": message.get("To"),
-                    "cc": message.get("CC"),
-                    "date": message.get("ReceivedTime"),
-                    "subject": message.get("Subject"),
-                    "year": parsed_date.year if parsed_date else None,
-                    "month": parsed_date.month if parsed_date else None,
-                    "day": parsed_date.day if parsed_date else None,
-                    "time": parsed_date.strftime("%H:%M:%S") if parsed_date else None,
-                    "forwarded_by": message.get("ForwardedBy", {}).get("From"),
-                    "conversation_id": conversation_id,
-                    "topic": topic,
-                    "user_id": user_id,
-                    "data_source": "email",
-                }
-
-                attach_paths = message.get("AttachmentFiles")
-                if attach_paths and len(attach_paths) > 0:
-                    for attach_path in attach_paths:
-
-                        if not os.path.exists(os.path.join(root_attachment_file_loc, attach_path)):
-                            raise ValueError(
-                                f"Attachment file not found: {attach_path}"
-                            )
-                        if os.path.splitext(attach_path)[1] not in [".pdf", ".docx", ".txt",".xls",".xlsx",".ppt",".pptx"]:
-                            print("File type not supported for file{}".format(attach_path))
+        emails_dir = os.path.join(os.environ["ROOT_LOCATION"], "data", user_id, "emails")
+        with EmailCatalog(Path(emails_dir) / "catalog.db") as catalog:
+            # Unique attachments keyed by content hash, embedded after all bodies
+            attachments = {}
+
+            es_client = await get_es_client()
+            ingest = bulk_ingest(es_client, EMAIL_INDEX) if bulk else nullcontext()
+            async with ingest, EmbeddingBatcher(vector_store, es_client=es_client if bulk else None,
+                                                index=EMAIL_INDEX) as batcher:
+                for pending in catalog.iter_conversations(conversation_ids, pending_only=True):
+                    conversation_id = pending.get("ConversationID")
+                    to_embed = {message.get("MessageID") for message in pending.get("Messages")}
+                    email = catalog.get_conversation(conversation_id)
+                    topic = email.get("Topic")
+                    stale = catalog.stale_message_ids(conversation_id)
+                    if stale:
+                        await es_client.delete_by_query(
+                            index=EMAIL_INDEX, query=_message_documents(user_id, "message_id", stale),
+                            conflicts="proceed"
+                        )
+                    # Earlier bodies per sender, to recognise a signature repeated in the thread
+                    sender_bodies = {}
+                    for message in email.get("Messages"):
+                        raw_body = message.get("Body") or ""
+                        previous_bodies = sender_bodies.setdefault(message.get("SenderName"), [])
+                        if message.get("MessageID") not in to_embed:
+                            # embedded already, but still an earlier body of its sender
+                            previous_bodies.append(raw_body)
                             continue
-                        res = md.convert(os.path.join(root_attachment_file_loc, attach_path))
-                        # print(res.text_content)
-                        if (
-                            not res.text_content
-                            or res.text_content == ""
-                            or res.text_content is None
-                        ):
-                            print("No body content found in email")
-                        else:
-                            # saving attachment content
-                            document = Document(
-                                page_content=res.text_content, metadata=metadata
-                            )
-                            uuid = str(uuid4())
-                            print
-                            await vector_store.aadd_documents(documents=[document], ids=[uuid])
-
-                body_content = message.get("Body")
-                document = Document(page_content=body_content, metadata=metadata)
-                uuid = str(uuid4())
-                await vector_store.aadd_documents(documents=[document], ids=[uuid])
+                        parsed_date = parse_received_time(message.get("ReceivedTime"))
+                        metadata = {
+                            "from": message.get("SenderName"),
+                            "to": message.get("To"),
+                            "cc": message.get("CC"),
+                            "date": message.get("ReceivedTime"),
+                            "received_at": parsed_date.isoformat() if parsed_date else None,
+                            "subject": message.get("Subject"),
+                            "year": parsed_date.year if parsed_date else None,
+                            "month": parsed_date.month if parsed_date else None,
+                            "day": parsed_date.day if parsed_date else None,
+                            "time": parsed_date.strftime("%H:%M:%S") if parsed_date else None,
+                            "forwarded_by": message.get("ForwardedBy", {}).get("From"),
+                            "conversation_id": conversation_id,
+                            "message_id": message.get("MessageID"),
+                            "labels": message.get("Labels", []),
+                            "topic": topic,
+                            "user_id": user_id,
+                            "data_source": "email",
+                        }
+
+                        for record in message.get("Attachments", []):
+                            if not record.get("Path"):
+                                # skipped by the fetch policy, only metadata was stored
+                                continue
+                            key = record.get("Hash") or record["Path"]
+                            if record.get("Hash") and catalog.is_blob_embedded(record["Hash"]):
+                                continue
+                            if key not in attachments:
+                                attachments[key] = {
+                                    "record": record,
+                                    "metadata": dict(metadata),
+                                    "conversation_ids": [],
+                                    "message_ids": [],
+                                }
+                            entry = attachments[key]
+                            if conversation_id not in entry["conversation_ids"]:
+                                entry["conversation_ids"].append(conversation_id)
+                            entry["message_ids"].append(message.get("MessageID"))
+
+                        # Only what the sender wrote in this message is embedded; quoted history and
+                        # signatures repeat text embedded with earlier messages
+                        body_content = strip_quoted_text(raw_body, previous_bodies[-3:])
+                        previous_bodies.append(raw_body)
+                        message_id = message.get("MessageID")
+                        await _add_chunks(
+                            batcher, body_content, metadata,
+                            ("email", user_id, conversation_id, message.get("OrderInConversation")),
+                            lambda message_id=message_id: catalog.mark_messages_embedded([message_id])
+                        )
+
+                # Attachments are converted on the shared conversion pool, several at a time
+                to_convert = {}
+                for key, entry in attachments.items():
+                    record = entry["record"]
+                    attach_path = record["Path"]
+                    if not os.path.exists(os.path.join(emails_dir, attach_path)):
+                        raise ValueError(
+                            f"Attachment file not found: {attach_path}"
+                        )
+                    if os.path.splitext(attach_path)[1].lower() not in SUPPORTED_DOCUMENT_EXTENSIONS:
+                        print("File type not supported for file{}".format(attach_path))
+                        continue
+                    to_convert[os.path.join(emails_dir, attach_path)] = (key, entry)
+
+                # Documents of an earlier embedding of a blob may outnumber its chunks now
+                hashes = [entry["record"]["Hash"] for _, entry in to_convert.values() if entry["record"].get("Hash")]
+                for start in range(0, len(hashes), DELETE_TERMS_CHUNK):
+                    await es_client.delete_by_query(
+                        index=EMAIL_INDEX,
+                        query=_attachment_documents(user_id, hashes[start:start + DELETE_TERMS_CHUNK]),
+                        conflicts="proceed"
+                    )
+
+                failures = ConversionFailureLog(Path(emails_dir).parent / "conversion_failures.jsonl")
+                # Blobs are content-addressed, so their hash is already known
+                digests = {path: entry["record"]["Hash"] for path, (_, entry) in to_convert.items()
+                           if entry["record"].get("Hash")}
+                async for path, text_content in get_document_converter().convert_many(to_convert, failures, digests):
+                    if text_content is None:
+                        # recorded as a conversion failure, retried once the file changes
+                        continue
+                    key, entry = to_convert[path]
+                    record = entry["record"]
+                    digest = record.get("Hash")
+                    mark_embedded = (lambda digest=digest: catalog.mark_blob_embedded(digest)) if digest else None
+                    if not text_content:
+                        print("No content found in attachment {}".format(record.get("FileName")))
+                        if mark_embedded:
+                            mark_embedded()
+                    else:
+                        # saving attachment content once for every message carrying it
+                        metadata = entry["metadata"]
+                        metadata.update({
+                            "file_name": record.get("FileName"),
+                            "attachment_hash": record.get("Hash"),
+                            "conversation_ids": entry["conversation_ids"],
+                            "message_ids": entry["message_ids"],
+                        })
+                        await _add_chunks(batcher, text_content, metadata,
+                                          ("email-attachment", user_id, key), mark_embedded,
+                                          chunks=cached_chunks(path, text_content))
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+
+async def _add_chunks(batcher:EmbeddingBatcher, text:str, metadata:Dict, id_parts:Tuple,
+                      on_indexed:Optional[Callable[[], None]], chunks:Optional[List[Chunk]]=None):
+    """Queue the chunks of a text; ``on_indexed`` runs once its last chunk is indexed."""
+    documents = chunk_documents(text, metadata, chunks=chunks)
+    if not documents:
+        if on_indexed:
+            on_indexed()
+        return
+    for index, document in enumerate(documents):
+        # Batches are indexed in order, so the last chunk is indexed after all the others
+        await batcher.add(
+            document,
+            doc_id=document_id(*id_parts, index),
+            on_indexed=on_indexed if index == len(documents) - 1 else None
+        )
+
+async def sync_email(vector_store:AsyncElasticsearchStore, user_id:str, update_result:Dict):
+    """Apply an email backup or incremental update to the vector store.
+
+    Message documents of deleted conversations, and of messages no longer
+    in a changed conversation, are removed. The new and changed messages of
+    changed conversations are embedded, while their unchanged messages keep
+    their documents, and relabeled messages only get their label metadata
+    rewritten. Attachment documents are shared between conversations by
+    content hash and are left in place. After a full backup, which reports
+    the conversations it dropped as deleted, everything not embedded yet
+    is embedded.
+    """
+    try:
+        es_client = await get_es_client()
+        changed = update_result.get("changed_conversations", [])
+        deleted = update_result.get("deleted_conversations", [])
+
+        if deleted:
+            await es_client.delete_by_query(
+                index=EMAIL_INDEX, query=_message_documents(user_id, "conversation_id", deleted), refresh=True
+            )
+        if changed:
+            emails_dir = os.path.join(os.environ["ROOT_LOCATION"], "data", user_id, "emails")
+            with EmailCatalog(Path(emails_dir) / "catalog.db") as catalog:
+                current = catalog.message_ids(changed)
+            removed = _message_documents(user_id, "conversation_id", changed)
+            removed["bool"]["must_not"].append({"terms": {"metadata.message_id": current}})
+            await es_client.delete_by_query(index=EMAIL_INDEX, query=removed, refresh=True)
+
+        if update_result.get("sync") == "full":
+            await embed_email(vector_store, user_id)
+        elif changed:
+            await embed_email(vector_store, user_id, conversation_ids=changed)
+
+        for message_id, labels in update_result.get("relabeled_messages", {}).items():
+            await es_client.update_by_query(
+                index=EMAIL_INDEX,
+                query={
+                    "bool": {
+                        "filter": [
+                            {"term": {"metadata.user_id": user_id}},
+                            {"term": {"metadata.message_id": message_id}},
+                        ]
+                    }
+                },
+                script={
+                    "source": "ctx._source.metadata.labels = params.labels",
+                    "params": {"labels": labels},
+                },
+            )
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
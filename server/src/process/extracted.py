@@ -0,0 +1,85 @@
+import os
+import json
+import hashlib
+import tempfile
+from functools import lru_cache
+from importlib import metadata
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from src.config.settings import get_settings
+from src.process.chunking import Chunk, chunk_text
+from src.process.tokens import EMBEDDING_ENCODING
+
+# Extracted text is kept next to its source file as <file><SIDECAR_SUFFIX>
+SIDECAR_SUFFIX = ".extracted.json"
+
+# Bump when the conversion options change the text produced for the same converter release
+EXTRACTION_FORMAT = 1
+
+@lru_cache()
+def converter_version() -> str:
+    try:
+        version = metadata.version("markitdown")
+    except metadata.PackageNotFoundError:
+        version = "unknown"
+    return f"markitdown-{version}/{EXTRACTION_FORMAT}"
+
+def is_sidecar(path: str) -> bool:
+    return path.endswith(SIDECAR_SUFFIX)
+
+def sidecar_path(path: str) -> Path:
+    return Path(path + SIDECAR_SUFFIX)
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _read_sidecar(path: str) -> Optional[Dict]:
+    try:
+        return json.loads(sidecar_path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+def _write_sidecar(path: str, data: Dict) -> None:
+    target = sidecar_path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=target.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def load_extracted_text(path: str, digest: str) -> Optional[str]:
+    """Text extracted earlier from the same file content by the same converter version."""
+    data = _read_sidecar(path)
+    if data and data.get("hash") == digest and data.get("converter") == converter_version():
+        return data.get("text")
+    return None
+
+def save_extracted_text(path: str, digest: str, text: str) -> None:
+    _write_sidecar(path, {"hash": digest, "converter": converter_version(), "text": text, "chunks": {}})
+
+def cached_chunks(path: str, text: str) -> List[Chunk]:
+    """Chunks of a file's extracted text, reusing the boundaries stored in its sidecar.
+
+    Boundaries are stored per encoding, chunk size and overlap, so changing
+    the chunk settings computes them once more.
+    """
+    settings = get_settings()
+    key = f"{EMBEDDING_ENCODING}:{settings.embedding_chunk_tokens}:{settings.embedding_chunk_overlap}"
+    data = _read_sidecar(path)
+    if data and data.get("text") == text and key in data.get("chunks", {}):
+        return [Chunk(text[start:end], start, end) for start, end in data["chunks"][key]]
+
+    chunks = chunk_text(text)
+    if data and data.get("text") == text:
+        data.setdefault("chunks", {})[key] = [[chunk.start, chunk.end] for chunk in chunks]
+        _write_sidecar(path, data)
+    return chunks
@@ -0,0 +1,13 @@
+import uuid
+from typing import Any
+
+# Fixed namespace so the same source always maps to the same document ID
+DOCUMENT_ID_NAMESPACE = uuid.UUID("6f1c7f3e-2a4b-5d8e-9c0f-3b7a1e5d2c94")
+
+def document_id(*parts: Any) -> str:
+    """Stable vector store ID of a document, derived from the identity of its source.
+
+    Embedding the same source again overwrites its documents instead of
+    adding duplicates, e.g. ``document_id("email", user_id, conversation_id, order, chunk_index)``.
+    """
+    return str(uuid.uuid5(DOCUMENT_ID_NAMESPACE, "/".join(str(part) for part in parts)))
@@ -0,0 +1,14 @@
+from functools import lru_cache
+
+import tiktoken
+
+# Encoding of the OpenAI text-embedding-3 models
+EMBEDDING_ENCODING = "cl100k_base"
+
+@lru_cache()
+def get_encoding() -> tiktoken.Encoding:
+    return tiktoken.get_encoding(EMBEDDING_ENCODING)
+
+def count_tokens(text: str) -> int:
+    """Number of tokens the embedding model sees for a text."""
+    return len(get_encoding().encode(text, disallowed_special=()))
@@ -1,9 +1,13 @@
+import logging
+from typing import Optional
 import fal_client
 from fastapi import APIRouter, Depends, HTTPException
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from pydantic import BaseModel
+from src.config.settings import get_settings
 from src.models.drive import ChatRequest, ChatResponse, GoogleCredential
 from src.services.database.elastic import return_drive, get_es_client
+from src.services.database.indices import recreate_index
 from src.services.database.mongodb import get_db
 from src.services.drive.client import format_drive, create_prompt_drive, get_drive_service
 from src.services.drive.storage import DriveStorage
@@ -30,10 +34,10 @@ async def chat(request: ChatRequest):
         "filter": {
             "bool": {
                 "must": [
-                    {"term": {"metadata.user_id.keyword": request.user_email}},
+                    {"term": {"metadata.user_id": request.user_email}},
                     {
                         "wildcard": {
-                            "metadata.file_path.keyword": {
+                            "metadata.file_path": {
                                 "value": f"*{request.directory}*",
                                 "case_insensitive": True,
                             }
@@ -77,6 +81,9 @@ class DriveSetupRequest(BaseModel):
     credential: GoogleCredential
     user_email: str
     folderId: str
+    # Subfolder levels to walk and listing requests in flight; settings apply when unset
+    depth: Optional[int] = None
+    concurrency: Optional[int] = None
 
 @router.post("/setup")
 async def setup_drive(
@@ -94,7 +101,14 @@ async def setup_drive(
         
         # Check if folder exists and needs update
         print("Checking folder status")
-        folder_contents = parse_folder_contents(service, request.folderId, depth=2)
+        depth = request.depth if request.depth is not None else get_settings().drive_traversal_max_depth
+        folder_contents = await parse_folder_contents(
+            service,
+            request.folderId,
+            depth=None if depth < 0 else depth,
+            service_factory=lambda: get_drive_service(request.credential.token),
+            concurrency=request.concurrency
+        )
         print(f"Found {len(folder_contents)} items in folder")
         
         folder_data = {
@@ -163,10 +177,8 @@ async def remove_all():
     """Remove all emails."""
     try:
         es_client = await get_es_client()
-        # Delete the "drive" index; ignore errors if it doesn't exist.
-        await es_client.indices.delete(index="drive", ignore=[400, 404])
-        # Re-create the "drive" index.
-        await es_client.indices.create(index="drive", ignore=400)
+        # Delete the "drive" index, or the index behind it once re-projected, and re-create it.
+        await recreate_index(es_client, "drive")
         return {"detail": "All drive files have been removed."}
 
     except Exception as e:
@@ -1,13 +1,22 @@
 import fal_client
+from pathlib import Path
+from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import BaseModel
+from src.config.settings import get_settings
+from src.models.email import ChatRequest, GoogleCredential
 from src.models.user import User
 from src.services.database.elastic import return_drive, return_email, get_es_client
+from src.services.database.indices import recreate_index
 from src.services.database.mongodb import get_db
 from src.services.email.client import format_emails, create_prompt_email, get_gmail_service
-from src.services.email.storage import EmailStorage
+from src.services.email.catalog import EmailCatalog
+from src.services.email.importer import resolve_import_path
+from src.services.email.storage import EmailStorage, get_backup_progress
 from src.agents.llm_agent import generate_response
-from src.process.email.preprocess import embed_email
+from src.process.email.preprocess import sync_email
 
 
 router = APIRouter()
@@ -20,7 +29,7 @@ async def chat(request: ChatRequest):
         # TODO: Implement a search query to retrieve relevant emails
         search_kwargs = {
             "k": 10,
-            "filter": {"term": {"metadata.user_id.keyword": request.user_email}},
+            "filter": {"term": {"metadata.user_id": request.user_email}},
         }
 
         retrieved_documents = await vector_store.as_retriever(
@@ -56,6 +65,8 @@ async def chat(request: ChatRequest):
 class EmailSetupRequest(BaseModel):
     credential: GoogleCredential
     user_email: str
+    concurrency: Optional[int] = None
+    ingest_mode: Optional[str] = None
 
 @router.post("/setup")
 async def setup_email(
@@ -66,13 +77,22 @@ async def setup_email(
     try:
         print(f"Starting Email setup for user: {request.user_email}")
         service = get_gmail_service(request.credential.token)
-        storage = EmailStorage(request.user_email)
-
-        print("Starting email backup/update")
-        if await storage.should_update():
-            backup_result = await storage.update_emails(service)
-        else:
-            backup_result = await storage.backup_emails(service)
+        with EmailStorage(request.user_email) as storage:
+            print("Starting email backup/update")
+            service_factory = lambda: get_gmail_service(request.credential.token)
+            if await storage.should_update():
+                backup_result = await storage.update_emails(
+                    service,
+                    service_factory=service_factory,
+                    concurrency=request.concurrency
+                )
+            else:
+                backup_result = await storage.backup_emails(
+                    service,
+                    service_factory=service_factory,
+                    concurrency=request.concurrency,
+                    ingest_mode=request.ingest_mode
+                )
         print("Email backup/update completed")
 
         # Embed in vectorstore
@@ -80,7 +100,8 @@ async def setup_email(
         try:
             print("Starting vector store embedding")
             vector_store = await return_email()
-            await embed_email(vector_store, request.user_email)
+            # Also removes the documents of conversations a full backup no longer found
+            await sync_email(vector_store, request.user_email, backup_result)
             print("Vector store embedding completed")
         except Exception as e:
             print(f"Vector store operation failed: {str(e)}")
@@ -105,19 +126,75 @@ async def setup_email(
         """
         
         print(f"Email setup completed successfully for user: {request.user_email}")
-        return {"status": "success", "path": str(storage.emails_dir)}
+        summary = {
+            key: len(value) if isinstance(value, (list, dict)) else value
+            for key, value in backup_result.items()
+        }
+        return {"status": "success", "path": str(storage.emails_dir), "summary": summary}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+class AttachmentFetchRequest(BaseModel):
+    credential: GoogleCredential
+    user_email: str
+    message_id: str
+    part_id: str
+
+@router.post("/attachments/fetch")
+async def fetch_attachment(request: AttachmentFetchRequest):
+    """Download an attachment that was skipped during backup."""
+    try:
+        service = get_gmail_service(request.credential.token)
+        with EmailStorage(request.user_email) as storage:
+            return await storage.fetch_skipped_attachment(service, request.message_id, request.part_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class EmailImportRequest(BaseModel):
+    user_email: str
+    path: str
+    workers: Optional[int] = None
+
+@router.post("/import")
+async def import_emails(request: EmailImportRequest):
+    """Import a mbox/EML archive, such as a Google Takeout export, for a user.
+
+    ``path`` is resolved inside the EMAIL_IMPORT_ROOT directory; archives
+    elsewhere on the server are refused.
+    """
+    try:
+        path = resolve_import_path(request.path, Path(get_settings().email_import_root))
+        with EmailStorage(request.user_email) as storage:
+            import_result = await storage.import_archive(path, workers=request.workers)
+            return {"status": "success", "path": str(storage.emails_dir), "summary": import_result}
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/setup/progress")
+async def setup_progress(user_email: str):
+    """Get the progress of a user's email backup."""
+    progress = get_backup_progress(user_email)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="No email backup found for user")
+    return progress
+
 @router.post("/remove_all")
 async def remove_all():
     """Remove all emails."""
     try:
         es_client = await get_es_client()
-        # Delete the "drive" index; ignore errors if it doesn't exist.
-        await es_client.indices.delete(index="email", ignore=[400, 404])
-        # Re-create the "drive" index.
-        await es_client.indices.create(index="email", ignore=400)
+        # Delete the "email" index, or the index behind it once re-projected, and re-create it.
+        await recreate_index(es_client, "email")
+        # Everything has to be embedded again
+        for catalog_path in Path("data").glob("*/emails/catalog.db"):
+            with EmailCatalog(catalog_path) as catalog:
+                catalog.reset_embed_status()
         return {"detail": "All email files have been removed."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
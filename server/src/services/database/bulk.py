@@ -0,0 +1,145 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Union
+
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_bulk
+
+from src.config.settings import get_settings
+
+# Document fields written by AsyncElasticsearchStore
+TEXT_FIELD = "text"
+VECTOR_FIELD = "vector"
+
+# Bulk requests carry vectors and force-merges rewrite segments; both outlast the client default
+BULK_REQUEST_TIMEOUT = 120
+FORCE_MERGE_TIMEOUT = 3600
+
+# Key in the index mapping's _meta holding the settings a load replaced, until they are restored
+BULK_MARKER = "bulk_ingest"
+
+# Loads in progress per index, so the settings are restored only when the last one ends
+_active_loads: Dict[str, int] = {}
+_saved_settings: Dict[str, Dict] = {}
+_loads_lock = asyncio.Lock()
+
+async def _index_settings(es_client: AsyncElasticsearch, index: str) -> Dict:
+    res = await es_client.indices.get_settings(
+        index=index, name=["index.refresh_interval", "index.number_of_replicas"], flat_settings=True
+    )
+    settings = next(iter(res.values()), {}).get("settings", {})
+    # A setting left at its default is restored by resetting it to None
+    return {
+        "refresh_interval": settings.get("index.refresh_interval"),
+        "number_of_replicas": settings.get("index.number_of_replicas"),
+    }
+
+async def _index_meta(es_client: AsyncElasticsearch, index: str) -> Dict:
+    res = await es_client.indices.get_mapping(index=index)
+    return next(iter(res.values()), {}).get("mappings", {}).get("_meta", {})
+
+async def _set_marker(es_client: AsyncElasticsearch, index: str, saved: Optional[Dict]) -> None:
+    # _meta is replaced as a whole, so other entries are carried over
+    meta = await _index_meta(es_client, index)
+    meta.pop(BULK_MARKER, None)
+    if saved is not None:
+        meta[BULK_MARKER] = saved
+    await es_client.indices.put_mapping(index=index, meta=meta)
+
+async def restore_interrupted_load(es_client: AsyncElasticsearch, index: str) -> bool:
+    """Restore the settings of a bulk load that never finished, e.g. after a crash.
+
+    Called at startup; returns whether a load was found. A bulk load
+    running in another process at that moment loses its tuning, but not
+    its documents.
+    """
+    saved = (await _index_meta(es_client, index)).get(BULK_MARKER)
+    if saved is None:
+        return False
+    await es_client.indices.put_settings(index=index, settings={"index": saved})
+    await es_client.indices.refresh(index=index)
+    await _set_marker(es_client, index, None)
+    print(f"Restored the settings of index {index} left by an interrupted bulk load")
+    return True
+
+@asynccontextmanager
+async def bulk_ingest(es_client: AsyncElasticsearch, index: str,
+                      force_merge: Optional[bool] = None) -> AsyncIterator[None]:
+    """Tune an index for a large initial load for the duration of the block.
+
+    Refreshes are disabled and replicas dropped while documents are
+    written, then both are restored, the index is refreshed once and,
+    with ``force_merge``, merged down to a single segment. Concurrent
+    loads into the same index share the tuning; the last one to finish
+    restores it.
+
+    The tuning applies to the whole index, so every user's searches miss
+    new documents and the index has no replica until the load ends; it is
+    meant for operator-run onboarding (scripts/bulk_embed.py), not for
+    requests. The replaced settings are kept in the index mapping until
+    they are restored, so a load cut short is undone at the next startup.
+    """
+    force_merge = get_settings().elastic_bulk_force_merge if force_merge is None else force_merge
+    async with _loads_lock:
+        if not _active_loads.get(index):
+            # After a crash the current settings are the tuned ones; the originals are in the marker
+            saved = (await _index_meta(es_client, index)).get(BULK_MARKER)
+            if saved is None:
+                saved = await _index_settings(es_client, index)
+                await _set_marker(es_client, index, saved)
+            _saved_settings[index] = saved
+            await es_client.indices.put_settings(
+                index=index, settings={"index": {"refresh_interval": "-1", "number_of_replicas": 0}}
+            )
+            print(f"Bulk ingest mode enabled for index {index}")
+        _active_loads[index] = _active_loads.get(index, 0) + 1
+
+    succeeded = False
+    try:
+        yield
+        succeeded = True
+    finally:
+        async with _loads_lock:
+            _active_loads[index] -= 1
+            last = not _active_loads[index]
+            if last:
+                del _active_loads[index]
+                await es_client.indices.put_settings(index=index, settings={"index": _saved_settings.pop(index)})
+                await es_client.indices.refresh(index=index)
+                await _set_marker(es_client, index, None)
+                print(f"Bulk ingest mode disabled for index {index}")
+        # Merged outside the lock, so a load starting meanwhile is not held up
+        if last and force_merge and succeeded:
+            print(f"Force-merging index {index}")
+            await es_client.options(request_timeout=FORCE_MERGE_TIMEOUT).indices.forcemerge(
+                index=index, max_num_segments=1
+            )
+
+def index_action(index: str, doc_id: str, text: str, vector: List[float], metadata: dict) -> Dict:
+    """Bulk action writing a document in the vector store's layout."""
+    return {
+        "_op_type": "index",
+        "_index": index,
+        "_id": doc_id,
+        "_source": {TEXT_FIELD: text, VECTOR_FIELD: vector, "metadata": metadata},
+    }
+
+async def bulk_write(es_client: AsyncElasticsearch, actions: Union[Iterable[Dict], AsyncIterable[Dict]],
+                     chunk_size: Optional[int] = None) -> int:
+    """Send bulk actions in requests of ``chunk_size`` documents without refreshing; returns the count written."""
+    indexed, _ = await async_bulk(
+        es_client.options(request_timeout=BULK_REQUEST_TIMEOUT),
+        actions,
+        chunk_size=chunk_size or get_settings().elastic_bulk_chunk_size,
+        refresh=False
+    )
+    return indexed
+
+async def bulk_index(es_client: AsyncElasticsearch, index: str, texts: List[str], vectors: List[List[float]],
+                     metadatas: List[dict], ids: List[str], chunk_size: Optional[int] = None) -> int:
+    """Write documents with precomputed vectors in the vector store's layout, without refreshing."""
+    actions = (
+        index_action(index, doc_id, text, vector, metadata)
+        for text, vector, metadata, doc_id in zip(texts, vectors, metadatas, ids)
+    )
+    return await bulk_write(es_client, actions, chunk_size)
@@ -1,19 +1,38 @@
+import asyncio
 from elasticsearch import AsyncElasticsearch
 from langchain_openai import OpenAIEmbeddings
 from src.config.settings import get_settings
 from elasticsearch.exceptions import ConnectionError as ESConnectionError
 from langchain_elasticsearch import AsyncElasticsearchStore
+from src.services.database.bulk import restore_interrupted_load
+from src.services.database.indices import ensure_index
+from src.services.embeddings.cache import CachedEmbeddings
+from src.services.embeddings.dispatcher import RateLimitedEmbeddings
+from src.services.embeddings.local import LocalEmbeddings
+from src.services.embeddings.reduced import ReducedEmbeddings
 
 
 
 async def init_elastic():
     global es_client, email_vector_store, drive_vector_store
-    openai_embeddings = OpenAIEmbeddings(
-    model="text-embedding-3-small",
-    )
-    
-
     settings = get_settings()
+    if settings.embedding_backend == "local":
+        embeddings = LocalEmbeddings.from_settings()
+        # Load the model at startup instead of on the first request
+        await asyncio.to_thread(embeddings.warm_up)
+    elif settings.embedding_backend == "openai":
+        embeddings = OpenAIEmbeddings(
+        model=settings.openai_embedding_model,
+        # retries are left to the dispatcher, which backs off across all requests
+        max_retries=0,
+        )
+        # Every user's ingestion and queries share one rate-limited dispatcher
+        embeddings = RateLimitedEmbeddings.from_settings(embeddings)
+    else:
+        raise ValueError(f"Unknown embedding backend: {settings.embedding_backend}")
+    # Unchanged and repeated texts are served from the local embedding cache
+    embeddings = CachedEmbeddings.from_settings(embeddings)
+
     es_client = AsyncElasticsearch(
         [settings.elastic_url],
         basic_auth=(settings.elastic_username, settings.elastic_password),
@@ -26,19 +45,31 @@ async def init_elastic():
     if not await es_client.ping():
         raise ESConnectionError("Could not connect to Elasticsearch")
     
+    # Vector size of the configured model
+    full_dims = len((await embeddings.aembed_documents(["Embedding dimension probe"]))[0])
+    # Each index may store shortened vectors; its documents and queries are embedded alike
+    model = settings.local_embedding_model if settings.embedding_backend == "local" else settings.openai_embedding_model
+    email_embeddings = ReducedEmbeddings.with_dimensions(
+        embeddings, settings.email_embedding_dimensions, full_dims, model)
+    drive_embeddings = ReducedEmbeddings.with_dimensions(
+        embeddings, settings.drive_embedding_dimensions, full_dims, model)
+
     email_vector_store = AsyncElasticsearchStore(
         es_connection=es_client,
         index_name="email",
-        embedding=openai_embeddings
+        embedding=email_embeddings
     )
     
     drive_vector_store = AsyncElasticsearchStore(
         es_connection=es_client,
         index_name="drive",
-        embedding=openai_embeddings
+        embedding=drive_embeddings
     )
-    es_client.indices.create(index="drive", ignore=400)
-    es_client.indices.create(index="email", ignore=400)
+    await ensure_index(es_client, "drive", settings.drive_embedding_dimensions or full_dims)
+    await ensure_index(es_client, "email", settings.email_embedding_dimensions or full_dims)
+    # A bulk load cut short leaves refreshes and replicas off for every user of the index
+    for index in ("drive", "email"):
+        await restore_interrupted_load(es_client, index)
     
     
 async def return_email():
@@ -0,0 +1,168 @@
+from typing import Dict, Optional
+
+from elasticsearch import AsyncElasticsearch
+
+from src.config.settings import get_settings
+
+VECTOR_INDEX_TYPES = {"hnsw", "int8_hnsw", "bbq_hnsw"}
+
+KEYWORD = {"type": "keyword"}
+INTEGER = {"type": "integer"}
+TEXT_WITH_KEYWORD = {"type": "text", "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}}
+
+# Metadata fields written by embed_email and embed_drive
+CHUNK_PROPERTIES = {
+    "chunk_index": INTEGER,
+    "chunk_count": INTEGER,
+    "chunk_start": INTEGER,
+    "chunk_end": INTEGER,
+}
+EMAIL_METADATA_PROPERTIES = {
+    "user_id": KEYWORD,
+    "data_source": KEYWORD,
+    "conversation_id": KEYWORD,
+    "conversation_ids": KEYWORD,
+    "message_id": KEYWORD,
+    "message_ids": KEYWORD,
+    "labels": KEYWORD,
+    "attachment_hash": KEYWORD,
+    "file_name": TEXT_WITH_KEYWORD,
+    "from": TEXT_WITH_KEYWORD,
+    "to": TEXT_WITH_KEYWORD,
+    "cc": TEXT_WITH_KEYWORD,
+    "forwarded_by": TEXT_WITH_KEYWORD,
+    "subject": {"type": "text"},
+    "topic": {"type": "text"},
+    # the header as received; received_at is the parsed, searchable form
+    "date": {"type": "keyword", "index": False},
+    "received_at": {"type": "date"},
+    "year": INTEGER,
+    "month": INTEGER,
+    "day": INTEGER,
+    "time": KEYWORD,
+    **CHUNK_PROPERTIES,
+}
+DRIVE_METADATA_PROPERTIES = {
+    "user_id": KEYWORD,
+    "data_source": KEYWORD,
+    "file_path": KEYWORD,
+    "file_name": TEXT_WITH_KEYWORD,
+    "file_type": KEYWORD,
+    "revision": KEYWORD,
+    **CHUNK_PROPERTIES,
+}
+METADATA_PROPERTIES = {
+    "email": EMAIL_METADATA_PROPERTIES,
+    "drive": DRIVE_METADATA_PROPERTIES,
+}
+
+def vector_mapping(dims: int) -> Dict:
+    """Mapping of the HNSW-indexed, optionally quantized vector field."""
+    settings = get_settings()
+    index_type = settings.elastic_vector_index_type
+    if index_type not in VECTOR_INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type: {index_type}")
+    return {
+        "type": "dense_vector",
+        "dims": dims,
+        "index": True,
+        "similarity": "cosine",
+        "index_options": {
+            "type": index_type,
+            "m": settings.elastic_hnsw_m,
+            "ef_construction": settings.elastic_hnsw_ef_construction,
+        },
+    }
+
+def index_mappings(index: str, dims: int) -> Dict:
+    """Mappings of a vector store index in the layout AsyncElasticsearchStore writes."""
+    return {
+        "dynamic_templates": [
+            # metadata added later is filterable without a mapping change
+            {"metadata_strings": {
+                "path_match": "metadata.*",
+                "match_mapping_type": "string",
+                "mapping": KEYWORD,
+            }},
+        ],
+        "properties": {
+            "text": {"type": "text"},
+            "vector": vector_mapping(dims),
+            "metadata": {"properties": METADATA_PROPERTIES[index]},
+        },
+    }
+
+async def concrete_index(es_client: AsyncElasticsearch, index: str) -> Optional[str]:
+    """Index an alias points to, the index itself when it is not an alias, or None when missing.
+
+    A re-projected index is served from a new index behind an alias of the
+    original name, see ``src.services.database.reproject``.
+    """
+    if await es_client.indices.exists_alias(name=index):
+        res = await es_client.indices.get_alias(name=index)
+        return next(iter(res))
+    if await es_client.indices.exists(index=index):
+        return index
+    return None
+
+async def _get_mappings(es_client: AsyncElasticsearch, index: str) -> Dict:
+    res = await es_client.indices.get_mapping(index=index)
+    return next(iter(res.values()), {}).get("mappings", {})
+
+def _vector_dims(mappings: Dict) -> Optional[int]:
+    return mappings.get("properties", {}).get("vector", {}).get("dims")
+
+async def index_dimensions(es_client: AsyncElasticsearch, index: str) -> Optional[int]:
+    """Vector size an existing index is mapped with, or None when it has no vector mapping yet."""
+    return _vector_dims(await _get_mappings(es_client, index))
+
+async def put_index_template(es_client: AsyncElasticsearch, index: str, dims: int) -> None:
+    await es_client.indices.put_index_template(
+        name=f"{index}-vectors",
+        index_patterns=[index, f"{index}-*"],
+        template={"mappings": index_mappings(index, dims)},
+        priority=100,
+    )
+
+async def ensure_index(es_client: AsyncElasticsearch, index: str, dims: int) -> None:
+    """Install the index template of a vector store index and create the index if missing.
+
+    The template also applies when the index is recreated elsewhere, e.g.
+    by the remove_all routes. An existing index mapped with another vector
+    size is refused, since its documents and the query vectors would not
+    match; it has to be re-projected first. So is one whose
+    ``metadata.user_id`` is not a keyword, e.g. an index created before the
+    explicit mappings where it was mapped as text: the per-user term
+    filters would not match exactly there. An existing index without the
+    field yet gets the explicit metadata fields it lacks.
+    """
+    await put_index_template(es_client, index, dims)
+    if not await es_client.indices.exists(index=index):
+        await es_client.indices.create(index=index, mappings=index_mappings(index, dims))
+        return
+    mappings = await _get_mappings(es_client, index)
+    indexed_dims = _vector_dims(mappings)
+    if indexed_dims is not None and indexed_dims != dims:
+        raise ValueError(
+            f"Index {index} stores {indexed_dims}-dimension vectors but {dims} are configured; "
+            f"run scripts/reproject_index.py {index} --dimensions {dims}"
+        )
+    metadata = mappings.get("properties", {}).get("metadata", {}).get("properties", {})
+    user_id_type = metadata.get("user_id", {}).get("type")
+    if user_id_type is None:
+        missing = {name: mapping for name, mapping in METADATA_PROPERTIES[index].items() if name not in metadata}
+        await es_client.indices.put_mapping(index=index, properties={"metadata": {"properties": missing}})
+    elif user_id_type != "keyword":
+        raise ValueError(
+            f"Index {index} maps metadata.user_id as {user_id_type}, not keyword, so per-user filters "
+            f"are unreliable; copy it into the current mappings with "
+            f"scripts/reproject_index.py {index} --dimensions {indexed_dims or dims}"
+        )
+
+async def recreate_index(es_client: AsyncElasticsearch, index: str) -> None:
+    """Drop every document of an index, leaving an empty index of the same name from the template."""
+    current = await concrete_index(es_client, index)
+    if current is not None:
+        # Deleting the index behind an alias removes the alias too
+        await es_client.indices.delete(index=current)
+    await es_client.indices.create(index=index)
@@ -0,0 +1,107 @@
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_scan
+
+from src.config.settings import get_settings
+from src.services.database.bulk import TEXT_FIELD, VECTOR_FIELD, bulk_ingest, bulk_write, index_action
+from src.services.database.indices import (
+    concrete_index, index_dimensions, index_mappings, put_index_template
+)
+from src.services.embeddings.reduced import reduce_vector
+
+async def _reprojected_actions(es_client: AsyncElasticsearch, source: str, target: str,
+                               dims: int) -> AsyncIterator[Dict]:
+    async for hit in async_scan(es_client, index=source, query={"query": {"match_all": {}}},
+                                size=get_settings().elastic_bulk_chunk_size):
+        document = hit["_source"]
+        yield index_action(target, hit["_id"], document.get(TEXT_FIELD),
+                           reduce_vector(document[VECTOR_FIELD], dims), document.get("metadata", {}))
+
+async def copy_reprojected(es_client: AsyncElasticsearch, index: str, dims: int) -> Dict:
+    """Copy an index into a new one with its vectors shortened to ``dims`` components.
+
+    The new index is named ``<index>-<dims>d-<timestamp>``, so the index
+    template of ``index`` applies to it, and is written in bulk ingest
+    mode. Documents written to the source index meanwhile are not copied,
+    so ingestion should be stopped first.
+    """
+    source = await concrete_index(es_client, index)
+    if source is None:
+        raise ValueError(f"Index {index} does not exist")
+    source_dims = await index_dimensions(es_client, source)
+    if source_dims is None:
+        raise ValueError(f"Index {source} has no vector mapping")
+    if dims > source_dims:
+        raise ValueError(f"Cannot re-project {source_dims}-dimension vectors to {dims} dimensions")
+
+    target = f"{index}-{dims}d-{datetime.utcnow():%Y%m%d%H%M%S}"
+    # The template keeps the current size until the swap, so a rejected run leaves it untouched
+    await es_client.indices.create(index=target, mappings=index_mappings(index, dims))
+    async with bulk_ingest(es_client, target, force_merge=True):
+        copied = await bulk_write(es_client, _reprojected_actions(es_client, source, target, dims))
+
+    source_count = (await es_client.count(index=source))["count"]
+    if copied != source_count:
+        raise ValueError(f"Copied {copied} of {source_count} documents from {source}; "
+                         f"{target} was left in place for inspection")
+    return {"source": source, "target": target, "source_dims": source_dims, "dims": dims, "documents": copied}
+
+async def measure_recall(es_client: AsyncElasticsearch, source: str, target: str, dims: int,
+                         sample_size: int = 100, k: int = 10, num_candidates: Optional[int] = None) -> float:
+    """Recall@k of kNN search on a re-projected index against exact search on the full vectors.
+
+    Vectors of randomly sampled documents serve as queries. The exact
+    neighbours come from a brute-force cosine scan of ``source``; the
+    measured ones from the HNSW search ``target`` serves, so the result
+    includes both the shortening and the approximate search. Each sampled
+    document is left out of its own results.
+    """
+    num_candidates = num_candidates or max(100, k * 10)
+    res = await es_client.search(
+        index=source,
+        query={"function_score": {"query": {"match_all": {}}, "random_score": {}}},
+        size=sample_size,
+        source=[VECTOR_FIELD],
+    )
+    found, expected = 0, 0
+    for hit in res["hits"]["hits"]:
+        vector = hit["_source"][VECTOR_FIELD]
+        exact = await es_client.search(
+            index=source,
+            query={"script_score": {
+                "query": {"match_all": {}},
+                "script": {"source": f"cosineSimilarity(params.query_vector, '{VECTOR_FIELD}') + 1.0",
+                           "params": {"query_vector": vector}},
+            }},
+            size=k + 1,
+            source=False,
+        )
+        approximate = await es_client.search(
+            index=target,
+            knn={"field": VECTOR_FIELD, "query_vector": reduce_vector(vector, dims),
+                 "k": k + 1, "num_candidates": num_candidates},
+            size=k + 1,
+            source=False,
+        )
+        exact_ids = _neighbour_ids(exact, hit["_id"], k)
+        found += len(set(exact_ids) & set(_neighbour_ids(approximate, hit["_id"], k)))
+        expected += len(exact_ids)
+    return found / expected if expected else 1.0
+
+def _neighbour_ids(res: Dict, own_id: str, k: int) -> List[str]:
+    return [hit["_id"] for hit in res["hits"]["hits"] if hit["_id"] != own_id][:k]
+
+async def swap_alias(es_client: AsyncElasticsearch, index: str, source: str, target: str, dims: int) -> None:
+    """Serve ``index`` from ``target`` and delete ``source``, in one atomic alias update.
+
+    The index template is switched to ``dims`` afterwards, so indices
+    created from then on, e.g. by remove_all, match the new size.
+    """
+    await es_client.indices.update_aliases(actions=[
+        {"add": {"index": target, "alias": index}},
+        # The original index carries the alias name, so it has to go in the same step
+        {"remove_index": {"index": source}},
+    ])
+    await put_index_template(es_client, index, dims)
@@ -1,8 +1,13 @@
-from typing import List, Dict
+import asyncio
+from typing import List, Dict, Optional, Set
 from langchain_core.documents import Document
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from src.config.settings import get_settings
+from src.services.drive.parser import FOLDER_MIME_TYPE, pack_parent_groups, parents_query
+
+FOLDERS_ONLY = f"trashed=false and mimeType='{FOLDER_MIME_TYPE}'"
 
 SCOPES = [
     'https://www.googleapis.com/auth/drive.readonly',
@@ -51,49 +56,67 @@ def get_folder_path(service, folder_id: str, path_segments: list = None) -> list
         print(f"Error getting folder path: {str(e)}")
         return path_segments
 
+def _list_all(service, query: str, fields: str, stop=None) -> List[Dict]:
+    """All items matching a query, page after page; ``stop`` ends paging early once it returns True."""
+    items = []
+    page_token = None
+    while True:
+        params = {
+            'q': query,
+            'spaces': 'drive',
+            'pageSize': get_settings().drive_list_page_size,
+            'fields': f'nextPageToken, files({fields})'
+        }
+        if page_token:
+            params['pageToken'] = page_token
+        response = service.files().list(**params).execute()
+        items.extend(response.get('files', []))
+        page_token = response.get('nextPageToken')
+        if not page_token or (stop and stop()):
+            return items
+
+def _folders_with_children(service, folder_ids: List[str]) -> Set[str]:
+    """Which of the folders have subfolders, using one combined query per group of folders."""
+    with_children = set()
+    for group in pack_parent_groups(folder_ids, FOLDERS_ONLY):
+        remaining = set(group)
+        try:
+            # paging stops as soon as every folder of the group has shown a child
+            for child in _list_all(service, parents_query(group, FOLDERS_ONLY), 'parents',
+                                   stop=lambda: not remaining):
+                found = remaining.intersection(child.get('parents', []))
+                with_children.update(found)
+                remaining.difference_update(found)
+        except Exception as group_error:
+            # the folders stay expandable; opening one lists its level for real
+            print(f"Error checking subfolders of {len(group)} folders: {str(group_error)}")
+            with_children.update(remaining)
+    return with_children
+
+def _list_folder_level(service, parent_id: Optional[str]) -> List[Dict]:
+    folders = _list_all(service, parents_query([parent_id or 'root'], FOLDERS_ONLY), 'id, name, mimeType')
+    with_children = _folders_with_children(service, [folder['id'] for folder in folders])
+    return [
+        {
+            'id': folder['id'],
+            'name': folder['name'],
+            'path': folder['name'],
+            'mimeType': folder['mimeType'],
+            'parentId': parent_id,
+            'hasChildren': folder['id'] in with_children
+        }
+        for folder in folders
+    ]
+
 async def list_folders(service, parent_id: str = None) -> Dict:
-    """List folders in Drive."""
+    """List folders in Drive.
+
+    ``hasChildren`` comes from combined subfolder queries over the whole
+    level rather than one probe per folder, and the blocking Drive calls
+    run off the event loop.
+    """
     try:
-        results = []
-        
-        # Build query
-        if parent_id is None:
-            query = "trashed=false and mimeType='application/vnd.google-apps.folder' and 'root' in parents"
-        else:
-            query = f"trashed=false and mimeType='application/vnd.google-apps.folder' and '{parent_id}' in parents"
-        
-        response = service.files().list(
-            q=query,
-            spaces='drive',
-            fields='files(id, name, mimeType)'
-        ).execute()
-        
-        folders = response.get('files', [])
-        
-        for folder in folders:
-            try:
-                # Check for children
-                children_response = service.files().list(
-                    q=f"trashed=false and mimeType='application/vnd.google-apps.folder' and '{folder['id']}' in parents",
-                    spaces='drive',
-                    pageSize=1,
-                    fields='files(id)'
-                ).execute()
-                
-                has_children = len(children_response.get('files', [])) > 0
-                
-                results.append({
-                    'id': folder['id'],
-                    'name': folder['name'],
-                    'path': folder['name'],
-                    'mimeType': folder['mimeType'],
-                    'parentId': parent_id,
-                    'hasChildren': has_children
-                })
-            except Exception as folder_error:
-                print(f"Error processing folder {folder.get('name', 'unknown')}: {str(folder_error)}")
-                continue
-        
+        results = await asyncio.to_thread(_list_folder_level, service, parent_id)
         return {"folders": results}
         
     except Exception as e:
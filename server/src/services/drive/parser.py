@@ -1,7 +1,19 @@
 import os
-from typing import Dict, List, Optional, Any, Union
+import heapq
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Any, Union, AsyncIterator, Callable, Iterable, Tuple
 from datetime import datetime
 
+from src.config.settings import get_settings
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# Item fields requested from files().list, everything parse_*_metadata reads
+ITEM_FIELDS = ('id, name, mimeType, createdTime, modifiedTime, size, parents, '
+               'webViewLink, iconLink, thumbnailLink, shared, owners, permissions')
+
 def parse_folder_metadata(folder: Dict) -> Dict:
     """Parse folder metadata from Drive API response."""
     return {
@@ -33,66 +45,188 @@ def parse_file_metadata(file: Dict) -> Dict:
         'shared': file.get('shared', False)
     }
 
-def parse_folder_contents(service: Any, folder_id: str, depth: int = 1, include_team_drives: bool = False) -> List[Dict]:
-    """Recursively parse folder contents up to specified depth.
-    
+def parents_query(folder_ids: List[str], condition: str = "trashed=false") -> str:
+    """Drive query for the items in any of the given folders that match ``condition``."""
+    clauses = " or ".join(f"'{folder_id}' in parents" for folder_id in folder_ids)
+    if len(folder_ids) > 1:
+        clauses = f"({clauses})"
+    return f"{clauses} and {condition}"
+
+def parent_group_size(folder_ids: List[str], max_parents: int, max_length: int,
+                      condition: str = "trashed=false") -> int:
+    """How many of the leading folders fit in one query within both limits (always at least one)."""
+    size = 1
+    length = len(parents_query(folder_ids[:1], condition)) + 2
+    while size < min(len(folder_ids), max_parents):
+        length += len(f" or '{folder_ids[size]}' in parents")
+        if length > max_length:
+            break
+        size += 1
+    return size
+
+def pack_parent_groups(folder_ids: List[str], condition: str = "trashed=false") -> List[List[str]]:
+    """Split folders into groups that are each listed with one query, within the configured limits."""
+    settings = get_settings()
+    groups = []
+    while folder_ids:
+        size = parent_group_size(folder_ids, settings.drive_query_max_parents,
+                                 settings.drive_query_max_length, condition)
+        groups.append(folder_ids[:size])
+        folder_ids = folder_ids[size:]
+    return groups
+
+async def iter_folder_contents(service: Any, folder_id: str, depth: Optional[int] = None,
+                               include_team_drives: bool = False,
+                               service_factory: Optional[Callable[[], Any]] = None,
+                               concurrency: Optional[int] = None) -> AsyncIterator[Dict]:
+    """Walk a folder breadth-first, yielding file/folder metadata as listings arrive.
+
+    Listing requests run on a pool of worker threads, up to ``concurrency``
+    at a time (one without a ``service_factory``, since a Drive service is
+    not thread-safe). Sibling folders are listed together: the folders
+    found at one level are packed into queries OR-ing up to
+    ``drive_query_max_parents`` parents within ``drive_query_max_length``
+    characters. A partial group is only sent once no shallower listing can
+    add to it. Shallower levels are listed before deeper ones. Each item is
+    yielded once, with a ``depth`` (0 for the folder's direct children);
+    subfolders are entered while their depth is below ``depth``, or always
+    when it is None.
+
     Args:
         service: Google Drive service instance
-        folder_id: ID of the folder to parse
-        depth: How deep to recurse into subfolders (default: 1)
+        folder_id: ID of the folder to walk
+        depth: How deep to descend into subfolders (default: no limit)
         include_team_drives: Whether to include shared drives (default: False)
-    
-    Returns:
-        List of dictionaries containing file/folder metadata
+        service_factory: Builds a Drive service for each worker thread
+        concurrency: Listing requests in flight (default: drive_traversal_concurrency)
     """
-    try:
-        contents = []
-        query = f"'{folder_id}' in parents and trashed=false"
-        
-        # Build request parameters
+    settings = get_settings()
+    workers = max(1, concurrency or settings.drive_traversal_concurrency) if service_factory else 1
+    local = threading.local()
+
+    def list_page(folder_ids: Tuple[str, ...], page_token: Optional[str]) -> Dict:
+        if service_factory is None:
+            thread_service = service
+        else:
+            thread_service = getattr(local, 'service', None)
+            if thread_service is None:
+                thread_service = local.service = service_factory()
         params = {
-            'q': query,
+            'q': parents_query(list(folder_ids)),
             'spaces': 'drive',
-            'fields': ('files(id, name, mimeType, createdTime, modifiedTime, size, parents, '
-                      'webViewLink, iconLink, thumbnailLink, shared, owners, permissions)'),
+            'pageSize': settings.drive_list_page_size,
+            'fields': f'nextPageToken, files({ITEM_FIELDS})',
             'supportsAllDrives': include_team_drives,
             'includeItemsFromAllDrives': include_team_drives
         }
-        
-        # Handle pagination
-        page_token = None
-        while True:
-            if page_token:
-                params['pageToken'] = page_token
-            
-            try:
-                response = service.files().list(**params).execute()
-                items = response.get('files', [])
-                
-                for item in items:
+        if page_token:
+            params['pageToken'] = page_token
+        return thread_service.files().list(**params).execute()
+
+    # Folders waiting to be listed, by the depth of their items
+    frontier: Dict[int, List[str]] = {0: [folder_id]}
+    # Next pages of running queries: (depth of the listed items, order queued, folders, page token)
+    continuations = []
+    queued = 0
+    running = {}
+
+    def next_listing() -> Optional[Tuple[int, Tuple[str, ...], Optional[str]]]:
+        """The shallowest listing that can be sent now, or None to wait for running ones."""
+        options = sorted([(level, 1) for level in frontier] +
+                         ([(continuations[0][0], 0)] if continuations else []))
+        for level, kind in options:
+            if kind == 0:
+                level, _, folder_ids, page_token = heapq.heappop(continuations)
+                return level, folder_ids, page_token
+            folder_ids = frontier[level]
+            size = parent_group_size(folder_ids, settings.drive_query_max_parents, settings.drive_query_max_length)
+            # Listings of the level above may still find more siblings to pack with these
+            still_filling = any(running_level < level for running_level, _ in running.values()) \
+                or (continuations and continuations[0][0] < level)
+            if size == len(folder_ids) and size < settings.drive_query_max_parents and still_filling:
+                continue
+            group = tuple(folder_ids[:size])
+            del folder_ids[:size]
+            if not folder_ids:
+                del frontier[level]
+            return level, group, None
+        return None
+
+    loop = asyncio.get_running_loop()
+    visited = {folder_id}
+    yielded = set()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="drive-traversal")
+    try:
+        while frontier or continuations or running:
+            while len(running) < workers:
+                listing = next_listing()
+                if listing is None:
+                    break
+                level, folder_ids, page_token = listing
+                future = loop.run_in_executor(executor, list_page, folder_ids, page_token)
+                running[future] = (level, folder_ids)
+
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                level, folder_ids = running.pop(future)
+                try:
+                    response = future.result()
+                except Exception as page_error:
+                    print(f"Error listing folders {', '.join(folder_ids)}: {str(page_error)}")
+                    continue
+
+                if response.get('nextPageToken'):
+                    heapq.heappush(continuations, (level, queued, folder_ids, response['nextPageToken']))
+                    queued += 1
+
+                for item in response.get('files', []):
                     try:
-                        is_folder = item['mimeType'] == 'application/vnd.google-apps.folder'
+                        if item['id'] in yielded:
+                            # an item with several parents is listed once per walked parent
+                            continue
+                        yielded.add(item['id'])
+                        is_folder = item['mimeType'] == FOLDER_MIME_TYPE
                         item_metadata = parse_folder_metadata(item) if is_folder else parse_file_metadata(item)
-                        
-                        if is_folder and depth > 0:
-                            item_metadata['contents'] = parse_folder_contents(
-                                service, item['id'], depth - 1, include_team_drives)
-                        
-                        contents.append(item_metadata)
+                        item_metadata['depth'] = level
+                        if is_folder and (depth is None or level < depth) and item['id'] not in visited:
+                            visited.add(item['id'])
+                            frontier.setdefault(level + 1, []).append(item['id'])
                     except Exception as item_error:
                         print(f"Error processing item {item.get('name', 'unknown')}: {str(item_error)}")
                         continue
-                
-                page_token = response.get('nextPageToken')
-                if not page_token:
-                    break
-                    
-            except Exception as page_error:
-                print(f"Error fetching page: {str(page_error)}")
-                break
-        
-        return contents
-        
+                    yield item_metadata
+    finally:
+        # Listings still running when the caller stops are abandoned rather than awaited
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def build_folder_tree(items: Iterable[Dict], folder_id: str) -> List[Dict]:
+    """Nest streamed items under their parent folders, as ``contents`` lists, below ``folder_id``."""
+    children: Dict[str, List[Dict]] = {}
+    for item in items:
+        # direct children may report the real ID of an alias such as 'root'
+        parents = [folder_id] if item.get('depth') == 0 else item.get('parents', [])
+        for parent in parents:
+            children.setdefault(parent, []).append(item)
+    for folders in children.values():
+        for item in folders:
+            if item['mimeType'] == FOLDER_MIME_TYPE and item['id'] in children:
+                item['contents'] = children[item['id']]
+    return children.get(folder_id, [])
+
+async def parse_folder_contents(service: Any, folder_id: str, depth: Optional[int] = None,
+                                include_team_drives: bool = False,
+                                service_factory: Optional[Callable[[], Any]] = None,
+                                concurrency: Optional[int] = None) -> List[Dict]:
+    """Walk a folder with ``iter_folder_contents`` and return its contents as a nested tree.
+
+    Returns:
+        List of dictionaries containing file/folder metadata, subfolders
+        carrying their own items under ``contents``
+    """
+    try:
+        items = [item async for item in iter_folder_contents(
+            service, folder_id, depth, include_team_drives, service_factory, concurrency)]
+        return build_folder_tree(items, folder_id)
     except Exception as e:
         print(f"Error parsing folder contents: {str(e)}")
         return []
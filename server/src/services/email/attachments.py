@@ -0,0 +1,87 @@
+import os
+import base64
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Dict
+
+# Base64 characters decoded per step by put_base64, a multiple of 4
+DEFAULT_DECODE_CHUNK_SIZE = 1024 * 1024
+
+class AttachmentStore:
+    """Content-addressed store for email attachments.
+
+    Every unique attachment is written once, under its SHA-256 digest, no
+    matter how many messages carry it. Messages keep a record pointing at
+    the stored blob instead of their own copy.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def blob_path(self, digest: str, extension: str) -> Path:
+        """Path of a stored blob; the extension is kept for document conversion."""
+        return self.root / digest[:2] / f"{digest}{extension.lower()}"
+
+    def relative_path(self, path: Path) -> str:
+        """Path of a blob relative to the directory containing the store."""
+        return path.relative_to(self.root.parent).as_posix()
+
+    def _commit(self, tmp_path: str, digest: str, filename: str, mime_type: str, size: int) -> Dict:
+        """Move a fully written temporary file into place unless the blob already exists."""
+        path = self.blob_path(digest, os.path.splitext(filename)[1])
+        if path.exists():
+            os.remove(tmp_path)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_path, path)
+
+        return {
+            "FileName": filename,
+            "Hash": digest,
+            "Path": self.relative_path(path),
+            "Size": size,
+            "MimeType": mime_type,
+        }
+
+    def put(self, data: bytes, filename: str, mime_type: str = "") -> Dict:
+        """Store attachment bytes unless an identical blob exists, and return its record."""
+        # Write to a temporary file first so concurrent writers never expose a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            return self._commit(tmp_path, hashlib.sha256(data).hexdigest(), filename, mime_type, len(data))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put_base64(self, data: str, filename: str, mime_type: str = "",
+                   chunk_size: int = DEFAULT_DECODE_CHUNK_SIZE) -> Dict:
+        """Decode URL-safe base64 attachment data straight into the store.
+
+        The data is decoded, hashed and written ``chunk_size`` characters at a
+        time, so the decoded attachment never exists in memory as a whole.
+        """
+        chunk_size = max(4, chunk_size - chunk_size % 4)
+        digest = hashlib.sha256()
+        size = 0
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for start in range(0, len(data), chunk_size):
+                    chunk = data[start:start + chunk_size]
+                    # Gmail may leave out the padding of the final chunk
+                    chunk += "=" * (-len(chunk) % 4)
+                    decoded = base64.urlsafe_b64decode(chunk)
+                    digest.update(decoded)
+                    f.write(decoded)
+                    size += len(decoded)
+            return self._commit(tmp_path, digest.hexdigest(), filename, mime_type, size)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
@@ -0,0 +1,77 @@
+import time
+import random
+import logging
+from typing import Any, Dict, Tuple
+
+from googleapiclient.errors import HttpError
+
+logger = logging.getLogger(__name__)
+
+# Gmail rejects batches with more than 100 sub-requests
+MAX_BATCH_SIZE = 100
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def is_retryable_error(error: Exception) -> bool:
+    """Check whether a failed (sub-)request is worth retrying."""
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUS_CODES
+    return isinstance(error, (ConnectionError, TimeoutError, OSError))
+
+def execute_batch(service: Any, requests: Dict[str, Any], batch_size: int = 50,
+                  max_retries: int = 3, backoff: float = 1.0) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+    """Execute API requests as Gmail batch requests.
+
+    Args:
+        service: Gmail service instance used to create the batches
+        requests: Mapping of a unique key to an unexecuted ``HttpRequest``
+        batch_size: Sub-requests per batch, capped at 100
+        max_retries: How many times failed sub-requests are retried
+        backoff: Base delay in seconds between retry rounds
+
+    Returns:
+        Tuple of responses and errors, both keyed like ``requests``. Only the
+        sub-requests that failed with a retryable error are sent again.
+    """
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    results: Dict[str, Any] = {}
+    errors: Dict[str, Exception] = {}
+    pending = dict(requests)
+    attempt = 0
+
+    while pending:
+        retry: Dict[str, Exception] = {}
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                results[request_id] = response
+            elif attempt < max_retries and is_retryable_error(exception):
+                retry[request_id] = exception
+            else:
+                errors[request_id] = exception
+
+        keys = list(pending)
+        for start in range(0, len(keys), batch_size):
+            chunk = keys[start:start + batch_size]
+            batch = service.new_batch_http_request(callback=callback)
+            for key in chunk:
+                batch.add(pending[key], request_id=key)
+            try:
+                batch.execute()
+            except Exception as e:
+                # The batch request itself failed, so none of its callbacks ran
+                for key in chunk:
+                    if attempt < max_retries and is_retryable_error(e):
+                        retry[key] = e
+                    else:
+                        errors[key] = e
+
+        if retry:
+            attempt += 1
+            delay = backoff * (2 ** (attempt - 1)) + random.uniform(0, backoff)
+            logger.warning(f"Retrying {len(retry)} failed batch sub-requests in {delay:.1f}s "
+                           f"(attempt {attempt}/{max_retries})")
+            time.sleep(delay)
+        pending = {key: pending[key] for key in retry}
+
+    return results, errors
@@ -0,0 +1,389 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from email.utils import parseaddr, parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    topic TEXT,
+    folder TEXT,
+    synced_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    message_id TEXT PRIMARY KEY,
+    thread_id TEXT NOT NULL REFERENCES threads(thread_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    subject TEXT,
+    sender TEXT,
+    sender_address TEXT,
+    recipients TEXT,
+    cc TEXT,
+    received_time TEXT,
+    received_at REAL,
+    body TEXT,
+    has_html INTEGER NOT NULL DEFAULT 0,
+    forwarded_by TEXT,
+    labels TEXT,
+    embed_status TEXT NOT NULL DEFAULT 'pending'
+);
+CREATE INDEX IF NOT EXISTS idx_messages_thread ON messages(thread_id, position);
+CREATE INDEX IF NOT EXISTS idx_messages_received_at ON messages(received_at);
+CREATE INDEX IF NOT EXISTS idx_messages_embed_status ON messages(embed_status);
+CREATE INDEX IF NOT EXISTS idx_messages_sender_address ON messages(sender_address);
+
+CREATE TABLE IF NOT EXISTS attachments (
+    message_id TEXT NOT NULL REFERENCES messages(message_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    file_name TEXT,
+    hash TEXT,
+    path TEXT,
+    size INTEGER,
+    mime_type TEXT,
+    status TEXT,
+    reason TEXT,
+    part_id TEXT,
+    PRIMARY KEY (message_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_attachments_hash ON attachments(hash);
+
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    embed_status TEXT NOT NULL DEFAULT 'pending'
+);
+CREATE INDEX IF NOT EXISTS idx_blobs_embed_status ON blobs(embed_status);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Messages still to embed: 'pending' ones have no documents yet, 'stale' ones have documents
+# of an earlier version that have to be deleted first
+TO_EMBED = "embed_status IN ('pending', 'stale')"
+
+# Message columns that end up in the embedded documents; a message whose values are unchanged
+# keeps its embedding when its conversation is written again
+EMBEDDED_COLUMNS = ("position", "subject", "sender", "recipients", "cc", "received_time", "body",
+                    "forwarded_by", "labels")
+
+def normalize_address(sender: Optional[str]) -> Optional[str]:
+    """Lower-cased email address of a From header such as 'Jane Doe <Jane@Example.com>'."""
+    if not sender:
+        return None
+    address = parseaddr(sender)[1] or sender
+    return address.strip().lower() or None
+
+def parse_received_time(value: str) -> Optional[datetime]:
+    """Parse a message date from an RFC 2822 header or the exported 'YYYY-MM-DD (Day) HH:MM:SS (UTC+hhmm)' form."""
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        pass
+    try:
+        # remove whatever is in the brackets
+        return datetime.strptime(value[0:10] + value[15:], "%Y-%m-%d %H:%M:%S (UTC%z)")
+    except ValueError:
+        return None
+
+class EmailCatalog:
+    """Indexed SQLite catalog of a user's backed up threads, messages and attachments.
+
+    Conversations go in and come out in the same dictionary layout the
+    backup has always produced ("ConversationID", "Topic", "Messages", ...),
+    so callers can stream them instead of loading the whole mailbox. The
+    catalog also tracks which messages and attachment blobs are embedded,
+    and the sync state of the mailbox.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self) -> "EmailCatalog":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    # Sync state
+
+    def get_state(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_state(self, key: str, value: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sync_state (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value))
+
+    # Conversations
+
+    def upsert_conversation(self, conversation: Dict) -> None:
+        """Replace a conversation and its messages.
+
+        New messages become pending for embedding and changed ones that
+        were embedded become stale; a message whose embedded content and
+        conversation topic are unchanged keeps its status, so writing a
+        mailbox again does not re-queue it.
+        """
+        thread_id = conversation["ConversationID"]
+        with self._lock, self._conn:
+            topic = self._conn.execute("SELECT topic FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+            same_topic = topic is not None and topic["topic"] == conversation.get("Topic")
+            previous = {
+                row["message_id"]: (tuple(row)[1:-1], row["embed_status"]) for row in self._conn.execute(
+                    f"SELECT message_id, {', '.join(EMBEDDED_COLUMNS)}, embed_status FROM messages "
+                    "WHERE thread_id = ?", (thread_id,))
+            }
+            self._conn.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+            self._conn.execute(
+                "INSERT INTO threads (thread_id, topic, folder, synced_at) VALUES (?, ?, ?, ?)",
+                (thread_id, conversation.get("Topic"), conversation.get("Folder"), datetime.utcnow().isoformat()))
+
+            for message in conversation.get("Messages", []):
+                position = message.get("OrderInConversation")
+                message_id = message.get("MessageID") or f"{thread_id}:{position}"
+                received_at = parse_received_time(message.get("ReceivedTime", ""))
+                forwarded_by = json.dumps(message["ForwardedBy"], ensure_ascii=False) \
+                    if message.get("ForwardedBy") else None
+                labels = json.dumps(message.get("Labels", []))
+                values = (position, message.get("Subject"), message.get("SenderName"), message.get("To"),
+                          message.get("CC"), message.get("ReceivedTime"), message.get("Body"), forwarded_by, labels)
+                previous_values, status = previous.get(message_id, (None, "pending"))
+                if status == "embedded" and not (same_topic and previous_values == values):
+                    status = "stale"
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO messages (message_id, thread_id, position, subject, sender, sender_address, "
+                    "recipients, cc, received_time, received_at, body, has_html, forwarded_by, labels, embed_status) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (message_id, thread_id, position, message.get("Subject"), message.get("SenderName"),
+                     normalize_address(message.get("SenderName")),
+                     message.get("To"), message.get("CC"), message.get("ReceivedTime"),
+                     received_at.timestamp() if received_at else None, message.get("Body"),
+                     int(bool(message.get("HasHtml"))), forwarded_by, labels, status))
+
+                for index, record in enumerate(message.get("Attachments", [])):
+                    self._insert_attachment(message_id, index, record)
+
+    def _insert_attachment(self, message_id: str, position: int, record: Dict) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO attachments (message_id, position, file_name, hash, path, size, mime_type, "
+            "status, reason, part_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (message_id, position, record.get("FileName"), record.get("Hash"), record.get("Path"),
+             record.get("Size"), record.get("MimeType"), record.get("Status"), record.get("Reason"),
+             record.get("PartID")))
+        if record.get("Hash"):
+            self._conn.execute("INSERT OR IGNORE INTO blobs (hash) VALUES (?)", (record["Hash"],))
+
+    def delete_conversation(self, thread_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+
+    def delete_conversations_synced_before(self, timestamp: str) -> List[Dict]:
+        """Remove conversations not written since ``timestamp`` and return their ID and folder."""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT thread_id, folder FROM threads WHERE synced_at < ?", (timestamp,)).fetchall()
+            self._conn.execute("DELETE FROM threads WHERE synced_at < ?", (timestamp,))
+        return [{"ConversationID": row["thread_id"], "Folder": row["folder"]} for row in rows]
+
+    def count_conversations(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM threads").fetchone()[0]
+
+    def get_conversation(self, thread_id: str, pending_only: bool = False) -> Optional[Dict]:
+        """Return a conversation, optionally with only the messages still to embed."""
+        with self._lock:
+            thread = self._conn.execute("SELECT * FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+            if thread is None:
+                return None
+            query = "SELECT * FROM messages WHERE thread_id = ?"
+            if pending_only:
+                query += f" AND {TO_EMBED}"
+            messages = self._conn.execute(query + " ORDER BY position", (thread_id,)).fetchall()
+            attachments = {}
+            for row in self._conn.execute(
+                    "SELECT a.* FROM attachments a JOIN messages m ON a.message_id = m.message_id "
+                    "WHERE m.thread_id = ? ORDER BY a.message_id, a.position", (thread_id,)):
+                attachments.setdefault(row["message_id"], []).append(self._attachment_record(row))
+
+        return {
+            "ConversationID": thread["thread_id"],
+            "Topic": thread["topic"],
+            "Folder": thread["folder"],
+            "Messages": [self._message_data(row, attachments.get(row["message_id"], [])) for row in messages]
+        }
+
+    def iter_conversations(self, thread_ids: Optional[Iterable[str]] = None,
+                           pending_only: bool = False) -> Iterator[Dict]:
+        """Stream conversations one at a time.
+
+        With ``pending_only`` only conversations with messages still to embed
+        are returned, each holding just those messages.
+        """
+        if thread_ids is None:
+            with self._lock:
+                if pending_only:
+                    rows = self._conn.execute(
+                        f"SELECT DISTINCT thread_id FROM messages WHERE {TO_EMBED}").fetchall()
+                else:
+                    rows = self._conn.execute("SELECT thread_id FROM threads").fetchall()
+            thread_ids = [row["thread_id"] for row in rows]
+
+        for thread_id in thread_ids:
+            conversation = self.get_conversation(thread_id, pending_only=pending_only)
+            if conversation is not None and (conversation["Messages"] or not pending_only):
+                yield conversation
+
+    def search_messages(self, sender: Optional[str] = None, since: Optional[datetime] = None,
+                        until: Optional[datetime] = None, limit: int = 100) -> List[Dict]:
+        """Look up messages by sender and received time range, newest first.
+
+        ``sender`` is matched against the sender's email address, case
+        insensitively: exactly when it is a full address, otherwise as a
+        prefix ("jane" or "jane.doe@exa"). Both are served by the sender
+        address index.
+        """
+        clauses = []
+        params: list = []
+        if sender:
+            address = sender.strip().lower()
+            if "@" in address and "." in address.split("@", 1)[1]:
+                clauses.append("sender_address = ?")
+                params.append(address)
+            else:
+                # A range rather than LIKE, which SQLite only serves from an index with NOCASE collation
+                clauses.append("sender_address >= ? AND sender_address < ?")
+                params.extend([address, address + "\U0010ffff"])
+        if since:
+            clauses.append("received_at >= ?")
+            params.append(since.timestamp())
+        if until:
+            clauses.append("received_at < ?")
+            params.append(until.timestamp())
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM messages {where} ORDER BY received_at DESC LIMIT ?", (*params, limit)).fetchall()
+        return [dict(self._message_data(row, []), ConversationID=row["thread_id"]) for row in rows]
+
+    # Messages and attachments
+
+    def find_message(self, message_id: str) -> Optional[Tuple[Dict, Dict]]:
+        """Return the conversation and message data for a Gmail message ID."""
+        with self._lock:
+            row = self._conn.execute("SELECT thread_id FROM messages WHERE message_id = ?", (message_id,)).fetchone()
+        if row is None:
+            return None
+        conversation = self.get_conversation(row["thread_id"])
+        message = next(message for message in conversation["Messages"] if message["MessageID"] == message_id)
+        return conversation, message
+
+    def update_labels(self, message_id: str, labels: List[str]) -> bool:
+        """Store new labels for a message; returns whether they changed."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE messages SET labels = ? WHERE message_id = ? AND labels IS NOT ?",
+                (json.dumps(labels), message_id, json.dumps(labels)))
+        return cursor.rowcount > 0
+
+    def replace_attachment(self, message_id: str, position: int, record: Dict) -> None:
+        with self._lock, self._conn:
+            self._insert_attachment(message_id, position, record)
+
+    # Embedding state
+
+    def message_ids(self, thread_ids: Iterable[str]) -> List[str]:
+        """IDs of every message of the given conversations."""
+        with self._lock:
+            return [row["message_id"] for thread_id in thread_ids for row in self._conn.execute(
+                "SELECT message_id FROM messages WHERE thread_id = ?", (thread_id,))]
+
+    def stale_message_ids(self, thread_id: str) -> List[str]:
+        """Messages of a conversation whose documents are of an earlier version."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT message_id FROM messages WHERE thread_id = ? AND embed_status = 'stale'",
+                (thread_id,)).fetchall()
+        return [row["message_id"] for row in rows]
+
+    def mark_messages_embedded(self, message_ids: Iterable[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE messages SET embed_status = 'embedded' WHERE message_id = ?",
+                [(message_id,) for message_id in message_ids])
+
+    def is_blob_embedded(self, digest: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT embed_status FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        return row is not None and row["embed_status"] == "embedded"
+
+    def mark_blob_embedded(self, digest: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO blobs (hash, embed_status) VALUES (?, 'embedded') "
+                "ON CONFLICT(hash) DO UPDATE SET embed_status = 'embedded'", (digest,))
+
+    def reset_embed_status(self) -> None:
+        """Mark everything as pending, e.g. after the vector index was dropped."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE messages SET embed_status = 'pending'")
+            self._conn.execute("UPDATE blobs SET embed_status = 'pending'")
+
+    # Row conversion
+
+    @staticmethod
+    def _attachment_record(row: sqlite3.Row) -> Dict:
+        record = {
+            "FileName": row["file_name"],
+            "Hash": row["hash"],
+            "Path": row["path"],
+            "Size": row["size"],
+            "MimeType": row["mime_type"],
+            "Status": row["status"],
+            "Reason": row["reason"],
+            "MessageID": row["message_id"],
+            "PartID": row["part_id"],
+        }
+        return {key: value for key, value in record.items() if value is not None}
+
+    @staticmethod
+    def _message_data(row: sqlite3.Row, attachments: List[Dict]) -> Dict:
+        message = {
+            "MessageID": row["message_id"],
+            "Labels": json.loads(row["labels"]) if row["labels"] else [],
+            "Subject": row["subject"],
+            "ConversationTopic": row["subject"],
+            "OrderInConversation": row["position"],
+            "AttachmentFiles": [record["Path"] for record in attachments if record.get("Path")],
+            "Attachments": attachments,
+            "HasHtml": bool(row["has_html"]),
+            "SenderName": row["sender"],
+            "To": row["recipients"],
+            "CC": row["cc"],
+            "ReceivedTime": row["received_time"],
+            "Body": row["body"],
+        }
+        if row["forwarded_by"]:
+            message["ForwardedBy"] = json.loads(row["forwarded_by"])
+        return message
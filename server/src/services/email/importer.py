@@ -0,0 +1,164 @@
+import re
+import mmap
+import hashlib
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .attachments import AttachmentStore
+from .parser import process_raw_message
+from .policy import AttachmentPolicy
+
+# A message to import: (file, start offset, end offset); offsets are None for a whole .eml file
+MessageSource = Tuple[str, Optional[int], Optional[int]]
+
+MBOX_SUFFIXES = {".mbox", ".mbx"}
+EML_SUFFIXES = {".eml"}
+
+# mboxrd escapes body lines starting with "From " (after any ">") with one more ">"
+_ESCAPED_FROM = re.compile(rb"^>(>*From )", re.MULTILINE)
+
+# Set in every worker process by init_import_worker
+_worker_store: Optional[AttachmentStore] = None
+_worker_policy: Optional[AttachmentPolicy] = None
+
+def iter_mbox_sources(path: Path) -> Iterator[MessageSource]:
+    """Yield the byte range of every message in an mbox file.
+
+    Messages start at lines beginning with ``From ``; only offsets are
+    collected here, the workers read and parse the messages themselves.
+    """
+    if path.stat().st_size == 0:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0 if mm[:5] == b"From " else mm.find(b"\nFrom ")
+        if start == -1:
+            return
+        if start:
+            start += 1
+        while True:
+            separator = mm.find(b"\nFrom ", start + 1)
+            end = separator + 1 if separator != -1 else len(mm)
+            yield str(path), start, end
+            if separator == -1:
+                return
+            start = end
+
+def iter_archive_sources(path: Path) -> Iterator[MessageSource]:
+    """Yield the messages of an .mbox file, an .eml file or a directory of either."""
+    if path.is_dir():
+        for child in sorted(path.rglob("*")):
+            if child.is_file() and child.suffix.lower() in MBOX_SUFFIXES | EML_SUFFIXES:
+                yield from iter_archive_sources(child)
+    elif path.suffix.lower() in EML_SUFFIXES:
+        yield str(path), None, None
+    else:
+        # Takeout and most mail clients export plain mbox, whatever the extension
+        yield from iter_mbox_sources(path)
+
+def read_source(source: MessageSource) -> bytes:
+    path, start, end = source
+    with open(path, "rb") as f:
+        if start is None:
+            return f.read()
+        f.seek(start)
+        raw = f.read(end - start)
+    # Drop the mbox "From " separator line
+    raw = raw.split(b"\n", 1)[1] if raw.startswith(b"From ") and b"\n" in raw else raw
+    # Undo the mbox escaping, so bodies match the messages a backup through the API fetches
+    return _ESCAPED_FROM.sub(rb"\1", raw)
+
+def resolve_import_path(path: str, root: Path) -> Path:
+    """Resolve a requested archive path inside the import root, refusing anything outside it.
+
+    Relative paths are taken from the root; symlinks and ``..`` are resolved
+    before the check, so they cannot lead out of it.
+    """
+    root = root.resolve()
+    resolved = (root / path).resolve()
+    if not resolved.is_relative_to(root):
+        raise PermissionError(f"Import path must be inside the import directory {root}")
+    if not resolved.exists():
+        raise ValueError(f"Import path not found: {path}")
+    return resolved
+
+def _short_hash(value: str) -> str:
+    return hashlib.sha1(value.encode("utf-8", errors="replace")).hexdigest()[:16]
+
+def thread_id_for(headers: Dict[str, str]) -> str:
+    """Conversation ID of an imported message.
+
+    Gmail exports carry the thread ID as the decimal X-GM-THRID header; the
+    Gmail API uses its hex form, so imported threads keep the same ID as a
+    backup through the API would. Other archives are threaded on the first
+    message of the References chain.
+    """
+    gmail_thread = headers.get("x-gm-thrid", "")
+    if gmail_thread.isdigit():
+        return format(int(gmail_thread), "x")
+    references = headers.get("references", "").split()
+    root = references[0] if references else headers.get("in-reply-to") or headers.get("message-id")
+    return f"import-{_short_hash(root)}" if root else ""
+
+def init_import_worker(attachments_root: str, policy: AttachmentPolicy) -> None:
+    """Process pool initializer; each worker writes attachments to the shared store."""
+    global _worker_store, _worker_policy
+    _worker_store = AttachmentStore(Path(attachments_root))
+    _worker_policy = policy
+
+def _store_attachments(attachments: List[Tuple[str, object]]) -> List[Dict]:
+    records = []
+    for filename, part in attachments:
+        data = part.get_payload(decode=True) or b""
+        mime_type = part.get_content_type()
+        fetch, reason = _worker_policy.evaluate(filename, mime_type, len(data))
+        if fetch:
+            record = _worker_store.put(data, filename, mime_type)
+            record["Status"] = "stored"
+        else:
+            record = {
+                "FileName": filename,
+                "MimeType": mime_type,
+                "Size": len(data),
+                "Status": "skipped",
+                "Reason": reason
+            }
+        records.append(record)
+    return records
+
+def parse_source(source: MessageSource) -> Dict:
+    """Parse one archived message into the fields a conversation is built from."""
+    raw = read_source(source)
+    headers, text_content, html_content, attachments = process_raw_message(raw)
+
+    try:
+        received_at = parsedate_to_datetime(headers["date"]).timestamp()
+    except (TypeError, ValueError, IndexError):
+        received_at = 0.0
+
+    labels = [label.strip() for label in headers.get("x-gmail-labels", "").split(",") if label.strip()]
+    # Archived messages have no Gmail message ID; the Message-ID header identifies
+    # duplicates across exports, the raw bytes identify messages without one
+    message_key = headers["message-id"] or hashlib.sha1(raw).hexdigest()
+    message_id = f"import-{_short_hash(message_key)}"
+
+    return {
+        "ThreadID": thread_id_for(headers) or message_id,
+        "MessageID": message_id,
+        "Labels": labels,
+        "Headers": {name: headers[name] for name in ("subject", "from", "to", "cc", "date")},
+        "ReceivedAt": received_at,
+        "Text": text_content,
+        "Html": html_content,
+        "Attachments": _store_attachments(attachments)
+    }
+
+def parse_sources(sources: List[MessageSource]) -> Tuple[List[Dict], List[Tuple[MessageSource, str]]]:
+    """Worker entry point: parse a batch of messages, keeping failures apart."""
+    parsed, failed = [], []
+    for source in sources:
+        try:
+            parsed.append(parse_source(source))
+        except Exception as e:
+            failed.append((source, str(e)))
+    return parsed, failed
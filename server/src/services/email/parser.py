@@ -7,10 +7,49 @@ from email.header import decode_header
 from pathlib import Path
 from typing import Tuple, Dict, List, Any, Optional
 
+from ...config.settings import get_settings
+from .attachments import AttachmentStore
+from .policy import AttachmentPolicy
+
 logger = logging.getLogger(__name__)
 
+# Lines that introduce a forwarded or quoted original message (Gmail, Outlook,
+# Apple Mail, in English and Korean). The lookbehind makes each run of dashes
+# a single match candidate, keeping the scan linear on long dash lines.
+_FORWARD_MARKER = re.compile(
+    r"(?<!-)-{3,}[ \t]*(?:Original Message|Forwarded message|원본 메시지|전달된 메일|전달된 메시지)[ \t]*-{3,}"
+    r"|Begin forwarded message:",
+    re.IGNORECASE
+)
+
+# Header labels of the original message; values run until the next label
+_HEADER_LABEL = re.compile(
+    r"(?<![\w-])(From|To|Cc|Subject|Sent|Date|보낸 사람|받는 사람|참조|제목|보낸 날짜|날짜)[ \t]*:",
+    re.IGNORECASE
+)
+_HEADER_FIELDS = {
+    "from": "from", "보낸 사람": "from",
+    "to": "to", "받는 사람": "to",
+    "cc": "cc", "참조": "cc",
+    "subject": "subject", "제목": "subject",
+    "sent": "date", "date": "date", "보낸 날짜": "date", "날짜": "date",
+}
+
+_BLANK_LINE = re.compile(r"\n[ \t]*\n")
+_HEADER_LINE = re.compile(
+    r"[ \t]*(?:From|To|Cc|Subject|Sent|Date|보낸 사람|받는 사람|참조|제목|보낸 날짜|날짜)[ \t]*:",
+    re.IGNORECASE
+)
+_EXTRA_BLANK_LINES = re.compile(r"\n{3,}")
+
 def parse_forwarded_email(body: str) -> dict:
-    """Parse forwarded email to extract original message metadata and content."""
+    """Parse forwarded email to extract original message metadata and content.
+
+    The body is scanned once for the earliest forward marker, and the header
+    block after it is tokenized on header labels, so the parser stays linear
+    in the size of the body. Headers may be one per line (Outlook) or run
+    together on a single line (HTML mail flattened to text).
+    """
     result = {
         "is_forwarded": False,
         "original": {
@@ -27,77 +66,157 @@ def parse_forwarded_email(body: str) -> dict:
         return result
     
     # Clean up HTML entities
-    body = html.unescape(body)
-    
-    # Check for forwarded message markers
-    markers = [
-        "-----Original Message-----",
-        "---------- Forwarded message ----------",
-        "Begin forwarded message:"
-    ]
-    
-    for marker in markers:
-        if marker in body:
-            result["is_forwarded"] = True
-            parts = body.split(marker, 1)
-            if len(parts) == 2:
-                original_content = parts[1].strip()
-                
-                # Split into headers and body
-                sections = re.split(r'\n\s*\n', original_content, maxsplit=1)
-                headers_section = sections[0] if sections else ""
-                body_section = sections[1] if len(sections) > 1 else ""
-                
-                # Extract headers
-                header_patterns = [
-                    ('from', r'From:\s*([^T][^o:][^\n]+?)(?=(?:To:|Subject:|Sent:|Date:|$))'),
-                    ('to', r'To:\s*([^C][^c:][^\n]+?)(?=(?:Cc:|Subject:|Sent:|Date:|$))'),
-                    ('cc', r'Cc:(?:\s*([^S][^e][^n][^t:][^\n]+?))?(?=(?:Subject:|Sent:|Date:|$))'),
-                    ('date', r'(?:Sent|Date):\s*([^S][^u][^b][^j][^\n]+?)(?=(?:Subject:|$))')
-                ]
-                
-                header_fields = {}
-                for field_name, pattern in header_patterns:
-                    match = re.search(pattern, headers_section, re.IGNORECASE | re.DOTALL)
-                    if match:
-                        value = match.group(1) if field_name != 'cc' else (match.group(1) or "")
-                        if value:
-                            value = value.strip()
-                            value = re.sub(r';\s*$', '', value)
-                            header_fields[field_name] = value
-                
-                # Extract subject
-                subject_match = re.search(r'Subject:\s*(.+?)(?=\n\s*\n|$)', headers_section, re.IGNORECASE | re.DOTALL)
-                if subject_match:
-                    subject = subject_match.group(1).strip().split('\n')[0].strip()
-                    header_fields['subject'] = subject
-                
-                # Update result
-                result['original'].update(header_fields)
-                
-                # Clean up body
-                if body_section:
-                    body_lines = []
-                    started = False
-                    for line in body_section.split('\n'):
-                        if not started and re.match(r'^(From|To|Cc|Subject|Sent|Date):', line.strip(), re.IGNORECASE):
-                            continue
-                        started = True
-                        body_lines.append(line)
-                    
-                    body_text = "\n".join(body_lines).strip()
-                    body_text = re.sub(r'\r\n', '\n', body_text)
-                    body_text = re.sub(r'\n{3,}', '\n\n', body_text)
-                    result["original"]["body"] = body_text
-                break
-    
-    # Clean up HTML entities in all fields
-    for key in result["original"]:
-        if result["original"][key]:
-            result["original"][key] = html.unescape(result["original"][key])
-    
+    body = html.unescape(body).replace("\r\n", "\n")
+
+    marker = _FORWARD_MARKER.search(body)
+    if marker is None:
+        return result
+
+    result["is_forwarded"] = True
+    original_content = body[marker.end():].strip()
+
+    # Split into headers and body
+    blank_line = _BLANK_LINE.search(original_content)
+    if blank_line:
+        headers_section = original_content[:blank_line.start()]
+        body_section = original_content[blank_line.end():]
+    else:
+        headers_section, body_section = original_content, ""
+
+    # Extract headers, keeping the first occurrence of each field
+    labels = list(_HEADER_LABEL.finditer(headers_section))
+    for index, label in enumerate(labels):
+        field_name = _HEADER_FIELDS[label.group(1).lower()]
+        if result["original"][field_name]:
+            continue
+        value_end = labels[index + 1].start() if index + 1 < len(labels) else len(headers_section)
+        value = headers_section[label.end():value_end]
+        if field_name == "subject":
+            value = value.strip().split("\n", 1)[0]
+        value = " ".join(value.split()).rstrip(";").strip()
+        result["original"][field_name] = value
+
+    # Clean up body, dropping header lines left over before the text starts
+    if body_section:
+        lines = body_section.split("\n")
+        start = 0
+        while start < len(lines) and _HEADER_LINE.match(lines[start]):
+            start += 1
+        body_text = "\n".join(lines[start:]).strip()
+        result["original"]["body"] = _EXTRA_BLANK_LINES.sub("\n\n", body_text)
+
     return result
 
+# Reply headers that introduce the quoted history below a reply: Gmail and
+# Apple Mail ("On ... wrote:", possibly wrapped onto a second line), Korean
+# Gmail ("...님이 작성:") and Outlook (original message line, or a rule
+# followed by the original's headers)
+_REPLY_HEADER = re.compile(
+    r"^[ \t]*On [^\n]{0,300}(?:\n[^\n]{0,300})?wrote:[ \t]*$"
+    r"|^[^\n]{0,300}님이 작성:[ \t]*$"
+    r"|^[ \t]*-{2,}[ \t]*(?:Original Message|원본 메시지)[ \t]*-{2,}"
+    r"|^_{10,}[ \t]*\n(?:From|보낸 사람)[ \t]*:",
+    re.MULTILINE | re.IGNORECASE
+)
+_QUOTED_LINE = re.compile(r"^[ \t]*>[^\n]*\n?", re.MULTILINE)
+# RFC 3676 signature separator; a bare "--" line is ordinary content
+_SIGNATURE_SEPARATOR = re.compile(r"^-- \r?$", re.MULTILINE)
+_MOBILE_FOOTER = re.compile(
+    r"^[ \t]*(?:Sent from my [^\n]{0,50}|Get Outlook for [^\n]{0,50}|Sent from Mail for Windows[^\n]{0,20}"
+    r"|[^\n]{0,30}에서 보냄)[ \t]*$\n?",
+    re.MULTILINE | re.IGNORECASE
+)
+# Tails shared with an earlier message of the same sender are treated as a
+# signature when they are this many lines long
+_SIGNATURE_MIN_LINES = 2
+_SIGNATURE_MAX_LINES = 10
+# Closing lines a signature block follows directly
+_SIGN_OFF = re.compile(
+    r"^[ \t]*(?:(?:best|kind|warm|many thanks and)?[ \t]*regards|best|cheers|thanks|thank you|many thanks"
+    r"|sincerely|yours(?: truly| sincerely)?|all the best|감사합니다|고맙습니다)[ \t]*[,.!]?[ \t]*$",
+    re.IGNORECASE
+)
+
+def _shared_tail(lines: List[str], previous: List[str]) -> int:
+    """Number of trailing non-empty lines two bodies have in common."""
+    count = 0
+    for line, other in zip(reversed(lines), reversed(previous)):
+        if line.strip() != other.strip():
+            break
+        count += 1
+    return count
+
+def _tail_start(lines: List[str], count: int) -> int:
+    """Index in ``lines`` of the first of the last ``count`` non-empty lines."""
+    seen = 0
+    for index in range(len(lines) - 1, -1, -1):
+        if lines[index].strip():
+            seen += 1
+            if seen == count:
+                return index
+    return 0
+
+def _starts_signature_block(lines: List[str], start: int) -> bool:
+    """Whether a tail starting at ``start`` is set apart from the text above it.
+
+    It must follow a blank line, or directly follow a sign-off such as
+    "Thanks,", and there must be text above it.
+    """
+    above = [line for line in lines[:start] if line.strip()]
+    if not above:
+        return False
+    return not lines[start - 1].strip() or bool(_SIGN_OFF.match(above[-1]))
+
+def _own_text(body: str) -> str:
+    """The part of a body written in this message, before the quoted history and signature."""
+    text = body
+    header = _REPLY_HEADER.search(text)
+    if header:
+        text = text[:header.start()]
+    text = _QUOTED_LINE.sub("", text)
+    separator = _SIGNATURE_SEPARATOR.search(text)
+    if separator:
+        text = text[:separator.start()]
+    return _MOBILE_FOOTER.sub("", text).strip()
+
+def _non_empty_lines(text: str) -> List[str]:
+    return [line for line in text.split("\n") if line.strip()]
+
+def strip_quoted_text(body: str, previous_bodies: Optional[List[str]] = None) -> str:
+    """Reduce an email body to what its sender wrote in this message.
+
+    Removes the quoted history below a reply header, ">"-quoted lines, the
+    signature after a "-- " separator, mobile client footers, and a
+    signature repeated from ``previous_bodies`` (earlier messages of the
+    same sender in the thread): a shared tail that, in both messages, is
+    set apart by a blank line or follows a sign-off. The body stored on disk is not changed; if
+    nothing would remain, the body is returned as it was.
+    """
+    if not body:
+        return body
+
+    text = _own_text(body)
+    lines = text.split("\n")
+    non_empty = _non_empty_lines(text)
+    for previous in previous_bodies or []:
+        previous_lines = _own_text(previous).split("\n")
+        shared = min(_shared_tail(non_empty, _non_empty_lines("\n".join(previous_lines))),
+                     _SIGNATURE_MAX_LINES, len(non_empty) - 1)
+        # Only a block set apart in both messages is a signature; repeated content such as
+        # re-sent agenda items runs on from the text above it
+        for count in range(shared, _SIGNATURE_MIN_LINES - 1, -1):
+            start = _tail_start(lines, count)
+            if _starts_signature_block(lines, start) and \
+                    _starts_signature_block(previous_lines, _tail_start(previous_lines, count)):
+                text = "\n".join(lines[:start]).rstrip()
+                break
+        else:
+            continue
+        break
+
+    text = _EXTRA_BLANK_LINES.sub("\n\n", text).strip()
+    return text or body
+
 def decode_email_part(part) -> Tuple[str, str]:
     """Decode an email message part and return its content and type."""
     content = ""
@@ -118,8 +237,89 @@ def decode_email_part(part) -> Tuple[str, str]:
     
     return content, content_type
 
-def process_message_part(service: Any, message_id: str, part: Dict, msg_folder: Path, attachment_files: List[str]) -> Tuple[Any, str]:
-    """Process a message part and return content and content type."""
+def attachment_filename(part: Dict, index: int) -> str:
+    """Return the file name of an attachment part, generating one for inline images."""
+    content_type = part.get("mimeType", "")
+    filename = part.get("filename", "")
+    if not filename and content_type.startswith("image/"):
+        # Generate filename for inline image
+        content_id = next((h["value"] for h in part.get("headers", []) if h["name"].lower() == "content-id"), None)
+        if content_id:
+            ext = content_type.split("/")[1]
+            filename = f"inline_{content_id.strip('<>')}_{index}.{ext}"
+        else:
+            filename = f"inline_image_{index}.{content_type.split('/')[1]}"
+    return filename
+
+def needs_attachment_fetch(part: Dict, policy: Optional[AttachmentPolicy] = None) -> bool:
+    """Check whether process_message_part downloads this part through attachments().get."""
+    content_type = part.get("mimeType", "")
+    body = part.get("body", {})
+    if "attachmentId" not in body:
+        return False
+    if content_type in ["text/plain", "text/html"]:
+        return True
+    filename = attachment_filename(part, 0)
+    if not filename:
+        return False
+    return policy is None or policy.evaluate(filename, content_type, body.get("size", 0))[0]
+
+def collect_attachment_requests(service: Any, message: Dict, policy: Optional[AttachmentPolicy] = None,
+                                sizes: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """Build the attachments().get requests needed for a message, keyed by attachment ID.
+
+    When ``sizes`` is given, the decoded size of every requested attachment is
+    recorded in it under the same key.
+    """
+    requests = {}
+
+    def walk(part):
+        if part.get("mimeType", "").startswith("multipart/"):
+            for child in part.get("parts", []):
+                walk(child)
+        elif needs_attachment_fetch(part, policy):
+            attachment_id = part["body"]["attachmentId"]
+            requests[attachment_id] = service.users().messages().attachments().get(
+                userId="me",
+                messageId=message["id"],
+                id=attachment_id
+            )
+            if sizes is not None:
+                sizes[attachment_id] = part["body"].get("size", 0)
+
+    walk(message.get("payload", {}))
+    return requests
+
+def fetch_attachment(service: Any, message_id: str, attachment_id: str,
+                     prefetched_attachments: Optional[Dict[str, Dict]] = None) -> Dict:
+    """Return an attachment, either from a batch prefetch or with its own request.
+
+    Prefetched attachments are removed from ``prefetched_attachments`` so their
+    data can be freed as soon as the caller has written it out.
+    """
+    if prefetched_attachments is not None:
+        attachment = prefetched_attachments.pop(attachment_id, None)
+        if attachment is None:
+            raise ValueError(f"Attachment {attachment_id} could not be fetched in batch")
+        return attachment
+    return service.users().messages().attachments().get(
+        userId="me",
+        messageId=message_id,
+        id=attachment_id
+    ).execute()
+
+def process_message_part(service: Any, message_id: str, part: Dict, attachment_store: AttachmentStore,
+                         attachment_files: List[Dict],
+                         prefetched_attachments: Optional[Dict[str, Dict]] = None,
+                         policy: Optional[AttachmentPolicy] = None) -> Tuple[Any, str]:
+    """Process a message part and return content and content type.
+
+    Attachments are written to ``attachment_store`` and their records
+    appended to ``attachment_files``. When ``prefetched_attachments`` is
+    given, attachment data is taken from it (batch ingestion) instead of
+    being requested one attachment at a time. Attachments rejected by
+    ``policy`` are not downloaded and are recorded as stubs instead.
+    """
     content = ""
     content_type = part.get("mimeType", "")
     body = part.get("body", {})
@@ -138,48 +338,46 @@ def process_message_part(service: Any, message_id: str, part: Dict, msg_folder:
                 logger.error(f"Error decoding {content_type} content: {str(e)}")
         elif "attachmentId" in body:
             try:
-                attachment = service.users().messages().attachments().get(
-                    userId="me",
-                    messageId=message_id,
-                    id=body["attachmentId"]
-                ).execute()
+                attachment = fetch_attachment(service, message_id, body["attachmentId"], prefetched_attachments)
                 content = base64.urlsafe_b64decode(attachment["data"].encode('utf-8')).decode('utf-8')
             except Exception as e:
                 logger.error(f"Error fetching {content_type} attachment: {str(e)}")
     
     # Handle attachments and inline images
     elif "filename" in part or content_type.startswith("image/"):
-        filename = part.get("filename", "")
-        if not filename and content_type.startswith("image/"):
-            # Generate filename for inline image
-            content_id = next((h["value"] for h in part.get("headers", []) if h["name"].lower() == "content-id"), None)
-            if content_id:
-                ext = content_type.split("/")[1]
-                filename = f"inline_{content_id.strip('<>')}_{len(attachment_files)}.{ext}"
-            else:
-                filename = f"inline_image_{len(attachment_files)}.{content_type.split('/')[1]}"
+        filename = attachment_filename(part, len(attachment_files))
         
         if filename:
             from ...utils.files import create_safe_name
             clean_filename = create_safe_name(filename)
-            attachment_path = msg_folder / clean_filename
+            fetch, reason = (True, "") if policy is None else policy.evaluate(
+                clean_filename, content_type, body.get("size", 0))
             
+            if "attachmentId" in body and not fetch:
+                # Keep enough to fetch the attachment later on demand
+                attachment_files.append({
+                    "FileName": clean_filename,
+                    "MimeType": content_type,
+                    "Size": body.get("size", 0),
+                    "Status": "skipped",
+                    "Reason": reason,
+                    "MessageID": message_id,
+                    "PartID": part.get("partId"),
+                })
             # Get attachment data
-            if "attachmentId" in body:
+            elif "attachmentId" in body:
                 try:
-                    attachment = service.users().messages().attachments().get(
-                        userId="me",
-                        messageId=message_id,
-                        id=body["attachmentId"]
-                    ).execute()
+                    attachment = fetch_attachment(service, message_id, body["attachmentId"], prefetched_attachments)
                     
-                    file_data = base64.urlsafe_b64decode(attachment["data"])
-                    attachment_path.write_bytes(file_data)
-                    attachment_files.append(clean_filename)
+                    record = attachment_store.put_base64(
+                        attachment.pop("data"), clean_filename, content_type,
+                        chunk_size=get_settings().email_attachment_decode_chunk_size)
+                    record["Status"] = "stored"
+                    attachment_files.append(record)
                     
                     # For inline images, return the saved path
                     if content_type.startswith("image/"):
-                        content = attachment_path
+                        content = attachment_store.root.parent / record["Path"]
                 except Exception as e:
                     logger.error(f"Error processing attachment {filename}: {str(e)}")
     
@@ -203,7 +401,13 @@ def process_raw_message(raw_message: bytes) -> Tuple[Dict[str, str], str, str, L
         'from': decode_header_str(email_msg.get('from', '')),
         'to': decode_header_str(email_msg.get('to', '')),
         'cc': decode_header_str(email_msg.get('cc', '')),
-        'date': decode_header_str(email_msg.get('date', ''))
+        'date': decode_header_str(email_msg.get('date', '')),
+        # Threading and Gmail export headers, used when importing archives
+        'message-id': email_msg.get('message-id', '').strip(),
+        'in-reply-to': email_msg.get('in-reply-to', '').strip(),
+        'references': email_msg.get('references', '').strip(),
+        'x-gm-thrid': email_msg.get('x-gm-thrid', '').strip(),
+        'x-gmail-labels': decode_header_str(email_msg.get('x-gmail-labels', ''))
     }
     
     # Process message parts
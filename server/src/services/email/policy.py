@@ -0,0 +1,39 @@
+import os
+from typing import Iterable, Optional, Tuple
+
+from ...config.constants import SUPPORTED_DOCUMENT_EXTENSIONS, SUPPORTED_DOCUMENT_MIME_TYPES
+from ...config.settings import get_settings
+
+def _parse_list(value: str) -> list:
+    return [item.strip().lower() for item in value.split(",") if item.strip()]
+
+class AttachmentPolicy:
+    """Decides which attachments are downloaded during an email backup.
+
+    A part is fetched when its extension or MIME type is allowed and it is
+    not larger than ``max_bytes``. Everything else is kept as a
+    metadata-only stub that can be fetched later on demand.
+    """
+
+    def __init__(self, extensions: Iterable[str], mime_types: Iterable[str], max_bytes: Optional[int] = None):
+        self.extensions = {extension.lower() for extension in extensions}
+        self.mime_types = {mime_type.lower() for mime_type in mime_types}
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_settings(cls) -> "AttachmentPolicy":
+        settings = get_settings()
+        return cls(
+            extensions=_parse_list(settings.email_attachment_extensions) or SUPPORTED_DOCUMENT_EXTENSIONS,
+            mime_types=_parse_list(settings.email_attachment_mime_types) or SUPPORTED_DOCUMENT_MIME_TYPES,
+            max_bytes=settings.email_attachment_max_bytes or None
+        )
+
+    def evaluate(self, filename: str, mime_type: str, size: int) -> Tuple[bool, str]:
+        """Return whether to fetch an attachment, and the reason when it is skipped."""
+        extension = os.path.splitext(filename)[1].lower()
+        if extension not in self.extensions and mime_type.lower() not in self.mime_types:
+            return False, "unsupported_type"
+        if self.max_bytes is not None and size > self.max_bytes:
+            return False, "too_large"
+        return True, ""
@@ -1,157 +1,835 @@
+import os
 import json
+import shutil
+import multiprocessing
+import sqlite3
+import asyncio
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
+from googleapiclient.errors import HttpError
+
+from ...config.settings import get_settings
 from ...utils.files import create_safe_folder_name, setup_directories
-from .parser import parse_forwarded_email, process_message_part
+from .attachments import AttachmentStore
+from .batch import execute_batch
+from .catalog import EmailCatalog
+from .importer import init_import_worker, iter_archive_sources, parse_sources
+from .parser import collect_attachment_requests, fetch_attachment, parse_forwarded_email, process_message_part
+from .policy import AttachmentPolicy
+
+# History record types that change what is stored for a thread
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+
+# Backup progress per user, exposed through get_backup_progress
+_backup_progress: Dict[str, Dict] = {}
+
+# Caps thread fetches across all users running a backup at the same time
+_global_fetch_slots: Optional[threading.BoundedSemaphore] = None
+_global_fetch_slots_lock = threading.Lock()
+
+def _get_global_fetch_slots() -> threading.BoundedSemaphore:
+    global _global_fetch_slots
+    with _global_fetch_slots_lock:
+        if _global_fetch_slots is None:
+            _global_fetch_slots = threading.BoundedSemaphore(
+                get_settings().email_backup_global_concurrency)
+        return _global_fetch_slots
+
+def get_backup_progress(email: str) -> Optional[Dict]:
+    """Return a snapshot of the running or last finished backup for a user."""
+    progress = _backup_progress.get(email)
+    return dict(progress) if progress is not None else None
 
 class EmailStorage:
     def __init__(self, email: str):
         self.email = email
-        _, self.emails_dir, _ = setup_directories(email)
+        self.emails_dir = setup_directories(email) / 'emails'
+        self.attachment_store = AttachmentStore(self.emails_dir / 'attachments')
+        self.attachment_policy = AttachmentPolicy.from_settings()
+        self.catalog = EmailCatalog(self.emails_dir / 'catalog.db')
+        self._migrate_legacy_backup()
+        self._local = threading.local()
+        self._progress_lock = threading.Lock()
+
+    def close(self) -> None:
+        """Close the catalog; the storage is not usable afterwards."""
+        self.catalog.close()
+
+    def __enter__(self) -> "EmailStorage":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
 
     async def should_update(self) -> bool:
-        """Check if directory exists and needs update."""
-        json_file = self.emails_dir / "email_conversations.json"
-        return json_file.exists()
+        """Check if a previous backup can be updated incrementally."""
+        return bool(self.catalog.get_state("history_id"))
+
+    def _migrate_legacy_backup(self) -> None:
+        """Import a backup written as email_conversations.json into the catalog."""
+        legacy_file = self.emails_dir / "email_conversations.json"
+        if not legacy_file.exists() or self.catalog.count_conversations():
+            return
+        print(f"Importing email_conversations.json into the catalog for {self.email}")
+        for conversation in json.loads(legacy_file.read_text(encoding='utf-8')):
+            self.catalog.upsert_conversation(conversation)
+
+        legacy_state = self.emails_dir / "sync_state.json"
+        if legacy_state.exists():
+            history_id = json.loads(legacy_state.read_text(encoding='utf-8')).get("history_id")
+            if history_id:
+                self.catalog.set_state("history_id", history_id)
+            legacy_state.rename(legacy_state.with_suffix(".json.migrated"))
+        legacy_file.rename(legacy_file.with_suffix(".json.migrated"))
+
+    def _thread_service(self, service: Any, service_factory: Optional[Callable[[], Any]]) -> Any:
+        """Return the Gmail service for the current worker thread.
+
+        The httplib2 transport behind a Gmail service is not thread-safe, so
+        every worker builds its own service through ``service_factory``.
+        """
+        if service_factory is None:
+            return service
+        thread_service = getattr(self._local, 'service', None)
+        if thread_service is None:
+            thread_service = service_factory()
+            self._local.service = thread_service
+        return thread_service
+
+    def _update_progress(self, progress: Dict, **increments: int) -> None:
+        with self._progress_lock:
+            for key, value in increments.items():
+                progress[key] += value
+            finished = progress['threads_done'] + progress['threads_failed']
+            interval = get_settings().email_backup_progress_interval
+            if finished and finished % interval == 0:
+                print(f"Email backup for {self.email}: {finished}/{progress['threads_listed']} threads "
+                      f"({progress['threads_failed']} failed)")
+
+    async def backup_emails(self, service: Any, service_factory: Optional[Callable[[], Any]] = None,
+                            concurrency: Optional[int] = None, ingest_mode: Optional[str] = None) -> Dict:
+        """Initial backup of emails.
+
+        Pages through every thread in the mailbox and fetches them on a
+        bounded pool of worker threads. ``concurrency`` overrides the per-user
+        default from settings; fetches are additionally capped across users
+        by ``email_backup_global_concurrency``. Without a ``service_factory``
+        the threads are fetched one at a time on ``service``, and the listing
+        runs on the same worker thread, since a service is not thread-safe.
+
+        In ``batch`` ingest mode each worker fetches a group of threads, and
+        then all of their attachments, through Gmail batch requests.
+        """
+        settings = get_settings()
+        ingest_mode = ingest_mode or settings.email_ingest_mode
+        if ingest_mode not in ("concurrent", "batch"):
+            raise ValueError(f"Unknown email ingest mode: {ingest_mode}")
+        workers = (concurrency or settings.email_backup_concurrency) if service_factory else 1
+        progress = {
+            "status": "running",
+            "started_at": datetime.utcnow().isoformat(),
+            "finished_at": None,
+            "listing_complete": False,
+            "threads_listed": 0,
+            "threads_done": 0,
+            "threads_failed": 0,
+        }
+        _backup_progress[self.email] = progress
+        started_at = datetime.utcnow().isoformat()
 
-    async def backup_emails(self, service: Any) -> Dict:
-        """Initial backup of emails."""
         try:
-            email_data = []
-
-            # Get threads
-            threads_response = service.users().threads().list(userId='me').execute()
-            threads = threads_response.get('threads', [])
-            
-            for thread in threads:
-                thread_id = thread['id']
-                thread_data = service.users().threads().get(userId='me', id=thread_id).execute()
-                
-                # Create conversation folder
-                first_message = thread_data['messages'][0]
-                headers = {header['name'].lower(): header['value'] 
-                          for header in first_message['payload']['headers']}
-                
-                timestamp = datetime.fromtimestamp(
-                    int(first_message['internalDate'])/1000
-                ).strftime("%Y-%m-%d_%H-%M-%S")
-                
-                subject = headers.get('subject', 'No Subject')
-                folder_name = create_safe_folder_name(subject, timestamp)
-                conv_folder = self.emails_dir / folder_name
-                conv_folder.mkdir(parents=True, exist_ok=True)
-
-                conversation_data = {
-                    "ConversationID": thread_id,
-                    "Topic": subject,
-                    "Messages": []
-                }
+            loop = asyncio.get_running_loop()
+            # Listing pauses while this many thread fetches are queued or running,
+            # so memory does not grow with the size of the mailbox
+            max_in_flight = workers * 2
+            in_flight = set()
 
-                # Process each message
-                for idx, message in enumerate(thread_data['messages']):
-                    headers = {header['name'].lower(): header['value'] 
-                              for header in message['payload']['headers']}
-                    
-                    msg_folder = conv_folder / f"message_{idx+1}"
-                    msg_folder.mkdir(parents=True, exist_ok=True)
-
-                    text_content = ""
-                    html_content = ""
-                    attachment_files = []
-
-                    def process_parts(parts):
-                        nonlocal text_content, html_content
-                        for part in parts:
-                            mime_type = part.get('mimeType', '')
-                            if mime_type.startswith('multipart/'):
-                                if 'parts' in part:
-                                    process_parts(part['parts'])
-                            else:
-                                content, content_type = process_message_part(
-                                    service, message['id'], part, msg_folder, attachment_files)
-                                if content:
-                                    if content_type == 'text/plain':
-                                        text_content = content if not text_content else text_content + "\n\n" + content
-                                    elif content_type == 'text/html':
-                                        html_content = content if not html_content else html_content + "<br><br>" + content
-
-                    if 'parts' in message['payload']:
-                        process_parts(message['payload']['parts'])
-                    elif 'body' in message['payload']:
-                        content, content_type = process_message_part(
-                            service, message['id'], message['payload'], msg_folder, attachment_files)
-                        if content_type == 'text/plain':
-                            text_content = content
-                        elif content_type == 'text/html':
-                            html_content = content
-                    
-                    # Save content
-                    if text_content:
-                        (msg_folder / "EMAIL_BODY.txt").write_text(text_content, encoding="utf-8")
-                    if html_content:
-                        (msg_folder / "EMAIL_BODY.html").write_text(html_content, encoding="utf-8")
-
-                    # Check forwarded
-                    forwarded_info = parse_forwarded_email(text_content)
-                    
-                    # Prepare message data
-                    message_data = {
-                        "Subject": subject,
-                        "ConversationTopic": subject,
-                        "OrderInConversation": idx + 1,
-                        "AttachmentFiles": [
-                            str((msg_folder / filename).relative_to(self.emails_dir))
-                            for filename in attachment_files
-                        ],
-                        "HasHtml": bool(html_content)
-                    }
-
-                    if forwarded_info["is_forwarded"]:
-                        message_data.update({
-                            "SenderName": forwarded_info["original"]["from"],
-                            "To": forwarded_info["original"]["to"],
-                            "CC": forwarded_info["original"]["cc"],
-                            "ReceivedTime": forwarded_info["original"]["date"],
-                            "Body": forwarded_info["original"]["body"],
-                            "ForwardedBy": {
-                                "From": headers.get('from', 'Unknown Sender'),
-                                "Date": headers.get('date', '')
-                            }
-                        })
+            async def submit(fn, *args):
+                while len(in_flight) >= max_in_flight:
+                    finished, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    in_flight.difference_update(finished)
+                    for future in finished:
+                        future.result()
+                in_flight.add(loop.run_in_executor(executor, fn, *args))
+
+            # Changes made while the backup runs are replayed by the next update
+            profile = await asyncio.to_thread(service.users().getProfile(userId='me').execute)
+            history_id = profile.get('historyId')
+
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="email-backup") as executor:
+                # Workers build their own services; without them the one worker uses ``service`` too
+                list_executor = None if service_factory else executor
+                page_token = None
+                while True:
+                    threads_response = await loop.run_in_executor(
+                        list_executor,
+                        service.users().threads().list(
+                            userId='me',
+                            maxResults=settings.email_backup_page_size,
+                            pageToken=page_token
+                        ).execute
+                    )
+                    threads = threads_response.get('threads', [])
+                    self._update_progress(progress, threads_listed=len(threads))
+
+                    thread_ids = [thread['id'] for thread in threads]
+                    if ingest_mode == "batch":
+                        for start in range(0, len(thread_ids), settings.email_batch_size):
+                            await submit(self._backup_thread_batch, service, service_factory,
+                                         thread_ids[start:start + settings.email_batch_size], progress)
                     else:
-                        message_data.update({
-                            "SenderName": headers.get('from', 'Unknown Sender'),
-                            "To": headers.get('to', ''),
-                            "CC": headers.get('cc', ''),
-                            "ReceivedTime": headers.get('date', ''),
-                            "Body": text_content
-                        })
+                        for thread_id in thread_ids:
+                            await submit(self._backup_thread, service, service_factory, thread_id, progress)
 
-                    conversation_data["Messages"].append(message_data)
+                    page_token = threads_response.get('nextPageToken')
+                    if not page_token:
+                        break
 
-                email_data.append(conversation_data)
+                progress["listing_complete"] = True
+                await asyncio.gather(*in_flight)
 
-            # Save JSON structure
-            json_file = self.emails_dir / "email_conversations.json"
-            json_file.write_text(json.dumps(email_data, indent=4, ensure_ascii=False), encoding='utf-8')
+            # Threads that were not seen again no longer exist in the mailbox; only
+            # safe to drop when no fetch failed
+            removed = []
+            if not progress["threads_failed"]:
+                removed = self.catalog.delete_conversations_synced_before(started_at)
+                for stale in removed:
+                    self._remove_thread_folder(stale)
+            if history_id:
+                self.catalog.set_state("history_id", str(history_id))
+            if history_id and not progress["threads_failed"]:
+                # Threads an earlier update failed on were fetched again
+                self.catalog.set_state("retry_threads", "[]")
+
+            progress["status"] = "complete"
+            progress["finished_at"] = datetime.utcnow().isoformat()
+            print(f"Email backup for {self.email} finished: {progress['threads_done']} threads, "
+                  f"{progress['threads_failed']} failed")
 
             return {
                 "message": "Backup complete",
+                "sync": "full",
                 "data_path": str(self.emails_dir),
-                "conversations": email_data
+                "threads_backed_up": progress["threads_done"],
+                "threads_failed": progress["threads_failed"],
+                "threads_removed": len(removed),
+                # Embedded documents of these are deleted by sync_email, like after an update
+                "deleted_conversations": [stale["ConversationID"] for stale in removed]
             }
 
         except Exception as e:
+            progress["status"] = "failed"
+            progress["finished_at"] = datetime.utcnow().isoformat()
             print(f"Error in backup_emails: {str(e)}")
             raise
 
-    async def update_emails(self, service: Any) -> Dict:
-        """Update existing email backup."""
-        print(f"Skipping email update for {self.email} (temporarily disabled)")
+    def _backup_thread(self, service: Any, service_factory: Optional[Callable[[], Any]],
+                       thread_id: str, progress: Dict) -> None:
+        """Fetch one thread and write its messages and attachments to disk.
+
+        Runs on a backup worker thread. Failures are counted in ``progress``
+        instead of aborting the whole backup.
+        """
+        try:
+            with _get_global_fetch_slots():
+                thread_service = self._thread_service(service, service_factory)
+                thread_data = thread_service.users().threads().get(userId='me', id=thread_id).execute()
+                conversation_data = self._save_thread(thread_service, thread_data)
+                self.catalog.upsert_conversation(conversation_data)
+            self._update_progress(progress, threads_done=1)
+        except Exception as e:
+            print(f"Error backing up thread {thread_id}: {str(e)}")
+            self._update_progress(progress, threads_failed=1)
+
+    def _backup_thread_batch(self, service: Any, service_factory: Optional[Callable[[], Any]],
+                             thread_ids: List[str], progress: Dict) -> None:
+        """Fetch a group of threads and their attachments with Gmail batch requests.
+
+        Runs on a backup worker thread. Attachments are prefetched for as
+        many threads at a time as fit in ``email_batch_attachment_bytes``,
+        and those threads are stored before the next attachments are
+        fetched; a thread whose attachments alone exceed the cap fetches
+        them one at a time. Sub-requests that keep failing after the retries
+        in execute_batch, and any other error, are counted in ``progress``
+        instead of aborting the whole backup.
+        """
+        settings = get_settings()
+        counts = {"done": 0, "failed": 0}
+        try:
+            with _get_global_fetch_slots():
+                thread_service = self._thread_service(service, service_factory)
+                thread_requests = {
+                    thread_id: thread_service.users().threads().get(userId='me', id=thread_id)
+                    for thread_id in thread_ids
+                }
+                threads, thread_errors = execute_batch(
+                    thread_service, thread_requests,
+                    batch_size=settings.email_batch_size,
+                    max_retries=settings.email_batch_max_retries
+                )
+                for thread_id, error in thread_errors.items():
+                    print(f"Error backing up thread {thread_id}: {str(error)}")
+                counts["failed"] += len(thread_errors)
+
+                group, attachment_requests, group_bytes = [], {}, 0
+                for thread_id in thread_ids:
+                    if thread_id not in threads:
+                        continue
+                    requests, sizes = {}, {}
+                    for message in threads[thread_id].get('messages', []):
+                        requests.update(collect_attachment_requests(
+                            thread_service, message, self.attachment_policy, sizes))
+                    thread_bytes = sum(sizes.values())
+                    if group and group_bytes + thread_bytes > settings.email_batch_attachment_bytes:
+                        self._save_thread_group(thread_service, group, threads, attachment_requests, counts)
+                        group, attachment_requests, group_bytes = [], {}, 0
+                    if thread_bytes > settings.email_batch_attachment_bytes:
+                        self._save_thread_group(thread_service, [thread_id], threads, None, counts)
+                        continue
+                    group.append(thread_id)
+                    attachment_requests.update(requests)
+                    group_bytes += thread_bytes
+                if group:
+                    self._save_thread_group(thread_service, group, threads, attachment_requests, counts)
+        except Exception as e:
+            print(f"Error backing up thread batch: {str(e)}")
+            counts["failed"] = len(thread_ids) - counts["done"]
+
+        self._update_progress(progress, threads_done=counts["done"], threads_failed=counts["failed"])
+
+    def _save_thread_group(self, thread_service: Any, group: List[str], threads: Dict[str, Dict],
+                           attachment_requests: Optional[Dict[str, Any]], counts: Dict[str, int]) -> None:
+        """Prefetch the attachments of fetched threads in batch, then store the threads.
+
+        With ``attachment_requests`` of None the threads fetch their
+        attachments one at a time while they are stored.
+        """
+        settings = get_settings()
+        attachments = None
+        if attachment_requests is not None:
+            attachments, attachment_errors = execute_batch(
+                thread_service, attachment_requests,
+                batch_size=settings.email_batch_size,
+                max_retries=settings.email_batch_max_retries
+            )
+            for attachment_id, error in attachment_errors.items():
+                print(f"Error fetching attachment {attachment_id}: {str(error)}")
+
+        for thread_id in group:
+            try:
+                conversation_data = self._save_thread(thread_service, threads.pop(thread_id), attachments)
+                self.catalog.upsert_conversation(conversation_data)
+                counts["done"] += 1
+            except Exception as e:
+                print(f"Error backing up thread {thread_id}: {str(e)}")
+                counts["failed"] += 1
+
+    def _save_thread(self, service: Any, thread_data: Dict,
+                     prefetched_attachments: Optional[Dict[str, Dict]] = None,
+                     parent: Optional[Path] = None) -> Dict:
+        """Write a fetched thread to its conversation folder and return its data.
+
+        The conversation data is also written to conversation.json in the
+        folder, so every thread is on disk as soon as it is processed. The
+        folder is created in ``parent`` instead of the emails directory when
+        given, e.g. to stage a rewrite.
+        """
+        thread_id = thread_data['id']
+
+        # Create conversation folder
+        first_message = thread_data['messages'][0]
+        headers = {header['name'].lower(): header['value']
+                  for header in first_message['payload']['headers']}
+
+        timestamp = datetime.fromtimestamp(
+            int(first_message['internalDate'])/1000
+        ).strftime("%Y-%m-%d_%H-%M-%S")
+
+        subject = headers.get('subject', 'No Subject')
+        folder_name = create_safe_folder_name(subject, timestamp)
+        conv_folder = (parent or self.emails_dir) / folder_name
+        conv_folder.mkdir(parents=True, exist_ok=True)
+
+        conversation_data = {
+            "ConversationID": thread_id,
+            "Topic": subject,
+            "Folder": folder_name,
+            "Messages": []
+        }
+
+        # Process each message
+        for idx, message in enumerate(thread_data['messages']):
+            headers = {header['name'].lower(): header['value']
+                      for header in message['payload']['headers']}
+
+            msg_folder = conv_folder / f"message_{idx+1}"
+            msg_folder.mkdir(parents=True, exist_ok=True)
+
+            text_content = ""
+            html_content = ""
+            attachment_files = []
+
+            def process_parts(parts):
+                nonlocal text_content, html_content
+                for part in parts:
+                    mime_type = part.get('mimeType', '')
+                    if mime_type.startswith('multipart/'):
+                        if 'parts' in part:
+                            process_parts(part['parts'])
+                    else:
+                        content, content_type = process_message_part(
+                            service, message['id'], part, self.attachment_store, attachment_files,
+                            prefetched_attachments, self.attachment_policy)
+                        if content:
+                            if content_type == 'text/plain':
+                                text_content = content if not text_content else text_content + "\n\n" + content
+                            elif content_type == 'text/html':
+                                html_content = content if not html_content else html_content + "<br><br>" + content
+
+            if 'parts' in message['payload']:
+                process_parts(message['payload']['parts'])
+            elif 'body' in message['payload']:
+                content, content_type = process_message_part(
+                    service, message['id'], message['payload'], self.attachment_store, attachment_files,
+                    prefetched_attachments, self.attachment_policy)
+                if content_type == 'text/plain':
+                    text_content = content
+                elif content_type == 'text/html':
+                    html_content = content
+
+            message_data = self._write_message(
+                msg_folder, message['id'], message.get('labelIds', []), subject, idx + 1,
+                headers, text_content, html_content, attachment_files)
+            conversation_data["Messages"].append(message_data)
+
+        (conv_folder / "conversation.json").write_text(
+            json.dumps(conversation_data, indent=4, ensure_ascii=False), encoding="utf-8")
+        return conversation_data
+
+    def _write_message(self, msg_folder: Path, message_id: str, labels: List[str], subject: str,
+                       order: int, headers: Dict[str, str], text_content: str, html_content: str,
+                       attachment_files: List[Dict]) -> Dict:
+        """Write a message's bodies and attachment manifest to its folder and return its data."""
+        if text_content:
+            (msg_folder / "EMAIL_BODY.txt").write_text(text_content, encoding="utf-8")
+        if html_content:
+            (msg_folder / "EMAIL_BODY.html").write_text(html_content, encoding="utf-8")
+        if attachment_files:
+            # The message folder only references attachments by their content hash
+            (msg_folder / "attachments.json").write_text(
+                json.dumps(attachment_files, indent=4, ensure_ascii=False), encoding="utf-8")
+
+        # Check forwarded
+        forwarded_info = parse_forwarded_email(text_content)
+
+        message_data = {
+            "MessageID": message_id,
+            "Labels": labels,
+            "Subject": subject,
+            "ConversationTopic": subject,
+            "OrderInConversation": order,
+            "AttachmentFiles": [record["Path"] for record in attachment_files if record.get("Path")],
+            "Attachments": attachment_files,
+            "HasHtml": bool(html_content)
+        }
+
+        if forwarded_info["is_forwarded"]:
+            message_data.update({
+                "SenderName": forwarded_info["original"]["from"],
+                "To": forwarded_info["original"]["to"],
+                "CC": forwarded_info["original"]["cc"],
+                "ReceivedTime": forwarded_info["original"]["date"],
+                "Body": forwarded_info["original"]["body"],
+                "ForwardedBy": {
+                    "From": headers.get('from', 'Unknown Sender'),
+                    "Date": headers.get('date', '')
+                }
+            })
+        else:
+            message_data.update({
+                "SenderName": headers.get('from', 'Unknown Sender'),
+                "To": headers.get('to', ''),
+                "CC": headers.get('cc', ''),
+                "ReceivedTime": headers.get('date', ''),
+                "Body": text_content
+            })
+        return message_data
+
+    async def fetch_skipped_attachment(self, service: Any, message_id: str, part_id: str) -> Dict:
+        """Download an attachment that the fetch policy skipped during backup.
+
+        The message is fetched again to get a current attachment ID for the
+        part. The stored conversation data and the message folder manifest are
+        updated to point at the downloaded blob.
+        """
+        found = self.catalog.find_message(message_id)
+        if found is None:
+            raise ValueError(f"Message {message_id} is not in the backup")
+        conversation, message_data = found
+        index, stub = next(
+            ((index, record) for index, record in enumerate(message_data.get("Attachments", []))
+             if record.get("PartID") == part_id),
+            (None, None)
+        )
+        if stub is None:
+            raise ValueError(f"Attachment part {part_id} is not in message {message_id}")
+        if stub.get("Status") == "stored":
+            return stub
+
+        def download():
+            message = service.users().messages().get(userId='me', id=message_id).execute()
+
+            def find_part(part):
+                if part.get("partId") == part_id:
+                    return part
+                for child in part.get("parts", []):
+                    found = find_part(child)
+                    if found:
+                        return found
+                return None
+
+            part = find_part(message['payload'])
+            if part is None or "attachmentId" not in part.get("body", {}):
+                raise ValueError(f"Attachment part {part_id} no longer exists in message {message_id}")
+            attachment = fetch_attachment(service, message_id, part['body']['attachmentId'])
+            record = self.attachment_store.put_base64(
+                attachment.pop("data"), stub["FileName"], stub.get("MimeType", ""),
+                chunk_size=get_settings().email_attachment_decode_chunk_size)
+            record.update({"Status": "stored", "MessageID": message_id, "PartID": part_id})
+            return record
+
+        record = await asyncio.to_thread(download)
+        message_data["Attachments"][index] = record
+        message_data["AttachmentFiles"] = [
+            attachment["Path"] for attachment in message_data["Attachments"] if attachment.get("Path")
+        ]
+        self.catalog.replace_attachment(message_id, index, record)
+
+        msg_folder = self.emails_dir / conversation.get("Folder", "") / f"message_{message_data['OrderInConversation']}"
+        if conversation.get("Folder") and msg_folder.exists():
+            (msg_folder / "attachments.json").write_text(
+                json.dumps(message_data["Attachments"], indent=4, ensure_ascii=False), encoding="utf-8")
+        return record
+
+    def _list_history_changes(self, service: Any, start_history_id: str) -> Tuple[Set[str], Set[str], str]:
+        """Collect the threads changed since ``start_history_id``.
+
+        Returns the threads whose messages were added or deleted, the threads
+        whose messages were only relabeled, and the latest history ID.
+        """
+        content_threads = set()
+        label_threads = set()
+        latest_history_id = start_history_id
+        page_token = None
+
+        while True:
+            response = service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                historyTypes=HISTORY_TYPES,
+                pageToken=page_token
+            ).execute()
+
+            for record in response.get('history', []):
+                for key in ('messagesAdded', 'messagesDeleted'):
+                    for change in record.get(key, []):
+                        content_threads.add(change['message']['threadId'])
+                for key in ('labelsAdded', 'labelsRemoved'):
+                    for change in record.get(key, []):
+                        label_threads.add(change['message']['threadId'])
+
+            latest_history_id = response.get('historyId', latest_history_id)
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+
+        return content_threads, label_threads - content_threads, latest_history_id
+
+    def _remove_thread_folder(self, conversation: Optional[Dict]) -> None:
+        if conversation and conversation.get("Folder"):
+            shutil.rmtree(self.emails_dir / conversation["Folder"], ignore_errors=True)
+
+    def _refresh_thread(self, service: Any, service_factory: Optional[Callable[[], Any]],
+                        thread_id: str) -> bool:
+        """Re-fetch a thread with added or deleted messages and rewrite its folder and catalog rows.
+
+        The new folder is written to a staging folder and swapped in once
+        complete, so a failed fetch or write leaves the stored thread as it
+        was. Returns False when the whole thread no longer exists.
+        """
+        conversation = self.catalog.get_conversation(thread_id)
+        with _get_global_fetch_slots():
+            thread_service = self._thread_service(service, service_factory)
+            try:
+                thread_data = thread_service.users().threads().get(userId='me', id=thread_id).execute()
+            except HttpError as e:
+                if e.resp.status != 404:
+                    raise
+                thread_data = None
+
+            if not thread_data or not thread_data.get('messages'):
+                self._remove_thread_folder(conversation)
+                return False
+
+            staging = self.emails_dir / f".refresh-{thread_id}"
+            shutil.rmtree(staging, ignore_errors=True)
+            try:
+                conversation_data = self._save_thread(thread_service, thread_data, parent=staging)
+                self._remove_thread_folder(conversation)
+                staged_folder = staging / conversation_data["Folder"]
+                target_folder = self.emails_dir / conversation_data["Folder"]
+                if target_folder.exists():
+                    # another thread with the same subject and date shares the folder
+                    shutil.copytree(staged_folder, target_folder, dirs_exist_ok=True)
+                else:
+                    staged_folder.rename(target_folder)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+            self.catalog.upsert_conversation(conversation_data)
+            return True
+
+    def _fetch_thread_labels(self, service: Any, service_factory: Optional[Callable[[], Any]],
+                             thread_id: str) -> Optional[Dict[str, List[str]]]:
+        """Fetch the current labels of a relabeled thread's messages without their content."""
+        with _get_global_fetch_slots():
+            thread_service = self._thread_service(service, service_factory)
+            try:
+                thread_data = thread_service.users().threads().get(
+                    userId='me', id=thread_id, format='minimal').execute()
+            except HttpError as e:
+                if e.resp.status == 404:
+                    return None
+                raise
+            return {message['id']: message.get('labelIds', []) for message in thread_data.get('messages', [])}
+
+    async def update_emails(self, service: Any, service_factory: Optional[Callable[[], Any]] = None,
+                            concurrency: Optional[int] = None) -> Dict:
+        """Update existing email backup from the Gmail history since the last sync.
+
+        Only threads with added, deleted or relabeled messages are touched.
+        Threads with added or deleted messages are re-fetched and their folder
+        rewritten; relabeled threads only get their stored labels updated.
+        A thread that fails does not abort the update; it is counted in
+        ``threads_failed`` and re-fetched by the next update. Falls back to
+        a full backup when there is no recorded history ID or Gmail no
+        longer has history that far back.
+        """
+        start_history_id = self.catalog.get_state("history_id")
+        if not start_history_id:
+            print(f"No sync state for {self.email}, running full backup")
+            return await self.backup_emails(service, service_factory, concurrency)
+
+        try:
+            content_threads, label_threads, history_id = await asyncio.to_thread(
+                self._list_history_changes, service, start_history_id)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            print(f"History {start_history_id} expired for {self.email}, running full backup")
+            return await self.backup_emails(service, service_factory, concurrency)
+
+        # Threads that failed last time are re-fetched, whether or not they changed again
+        content_threads |= set(json.loads(self.catalog.get_state("retry_threads") or "[]"))
+        label_threads -= content_threads
+
+        print(f"Email update for {self.email}: {len(content_threads)} changed threads, "
+              f"{len(label_threads)} relabeled threads")
+
+        settings = get_settings()
+        workers = (concurrency or settings.email_backup_concurrency) if service_factory else 1
+        content_threads = list(content_threads)
+        label_threads = list(label_threads)
+        loop = asyncio.get_running_loop()
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="email-update") as executor:
+            refreshed = await asyncio.gather(*[
+                loop.run_in_executor(executor, self._refresh_thread, service, service_factory, thread_id)
+                for thread_id in content_threads
+            ], return_exceptions=True)
+            labels = await asyncio.gather(*[
+                loop.run_in_executor(executor, self._fetch_thread_labels, service, service_factory, thread_id)
+                for thread_id in label_threads
+            ], return_exceptions=True)
+
+        changed = []
+        deleted = []
+        failed = []
+        for thread_id, exists in zip(content_threads, refreshed):
+            if isinstance(exists, Exception):
+                print(f"Error updating thread {thread_id}: {str(exists)}")
+                failed.append(thread_id)
+            elif exists:
+                changed.append(thread_id)
+            elif self.catalog.get_conversation(thread_id) is not None:
+                self.catalog.delete_conversation(thread_id)
+                deleted.append(thread_id)
+
+        relabeled_messages = {}
+        for thread_id, message_labels in zip(label_threads, labels):
+            if isinstance(message_labels, Exception):
+                print(f"Error updating labels of thread {thread_id}: {str(message_labels)}")
+                failed.append(thread_id)
+                continue
+            conversation = self.catalog.get_conversation(thread_id)
+            if conversation is None:
+                continue
+            if message_labels is None:
+                self._remove_thread_folder(conversation)
+                self.catalog.delete_conversation(thread_id)
+                deleted.append(thread_id)
+                continue
+            for message_id, message_label_ids in message_labels.items():
+                if self.catalog.update_labels(message_id, message_label_ids):
+                    relabeled_messages[message_id] = message_label_ids
+
+        self.catalog.set_state("retry_threads", json.dumps(failed))
+        self.catalog.set_state("history_id", str(history_id))
+        if failed:
+            print(f"Email update for {self.email}: {len(failed)} threads failed, retried by the next update")
+
+        return {
+            "message": "Update complete",
+            "sync": "incremental",
+            "data_path": str(self.emails_dir),
+            "changed_conversations": changed,
+            "deleted_conversations": deleted,
+            "relabeled_messages": relabeled_messages,
+            "threads_failed": len(failed),
+            "retry_threads": failed
+        }
+
+    async def import_archive(self, path: Path, workers: Optional[int] = None) -> Dict:
+        """Import an mbox file, an .eml file or a directory of them without the Gmail API.
+
+        Messages are parsed on a pool of ``workers`` processes (one per CPU
+        core by default) and written to the same conversation folders and
+        catalog as ``backup_emails``. Imported conversations are pending for
+        embedding like any other backup.
+        """
+        path = Path(path)
+        if not path.exists():
+            raise ValueError(f"Archive not found: {path}")
+
+        progress = {
+            "status": "running",
+            "started_at": datetime.utcnow().isoformat(),
+            "finished_at": None,
+            "listing_complete": False,
+            "messages_parsed": 0,
+            "messages_failed": 0,
+            "threads_done": 0,
+        }
+        _backup_progress[self.email] = progress
+
+        try:
+            result = await asyncio.to_thread(self._import_archive, path, workers, progress)
+            progress["status"] = "complete"
+            progress["finished_at"] = datetime.utcnow().isoformat()
+            print(f"Email import for {self.email} finished: {result['messages_imported']} messages in "
+                  f"{result['threads_imported']} threads, {result['messages_failed']} failed")
+            return result
+        except Exception as e:
+            progress["status"] = "failed"
+            progress["finished_at"] = datetime.utcnow().isoformat()
+            print(f"Error in import_archive: {str(e)}")
+            raise
+
+    def _import_archive(self, path: Path, workers: Optional[int], progress: Dict) -> Dict:
+        settings = get_settings()
+        workers = workers or settings.email_import_workers or os.cpu_count() or 1
+        batch_size = settings.email_import_batch_size
+
+        # Messages of a thread can be anywhere in an archive, so parsed messages are
+        # staged on disk and grouped into conversations once everything is parsed
+        staging_path = self.emails_dir / "import_staging.db"
+        staging_path.unlink(missing_ok=True)
+        staging = sqlite3.connect(staging_path)
+        try:
+            staging.execute(
+                "CREATE TABLE staged (message_id TEXT PRIMARY KEY, thread_id TEXT NOT NULL, "
+                "received_at REAL NOT NULL, seq INTEGER NOT NULL, record TEXT NOT NULL)")
+
+            def stage(parsed: List[Dict], failed: List) -> None:
+                with staging:
+                    for record in parsed:
+                        # The same message can be exported more than once, e.g. once per label
+                        staging.execute(
+                            "INSERT OR IGNORE INTO staged VALUES (?, ?, ?, ?, ?)",
+                            (record["MessageID"], record["ThreadID"], record["ReceivedAt"],
+                             progress["messages_parsed"], json.dumps(record, ensure_ascii=False)))
+                        progress["messages_parsed"] += 1
+                for source, error in failed:
+                    print(f"Error importing message at {source}: {error}")
+                progress["messages_failed"] += len(failed)
+
+            # Spawned rather than forked from the threaded server process, which is not fork-safe
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=init_import_worker,
+                                     initargs=(str(self.attachment_store.root), self.attachment_policy)) as executor:
+                # Bounded like backup_emails, so a large archive is never queued up in memory
+                in_flight = set()
+                batch = []
+                for source in iter_archive_sources(path):
+                    batch.append(source)
+                    if len(batch) < batch_size:
+                        continue
+                    if len(in_flight) >= workers * 2:
+                        finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            stage(*future.result())
+                    in_flight.add(executor.submit(parse_sources, batch))
+                    batch = []
+                if batch:
+                    in_flight.add(executor.submit(parse_sources, batch))
+                progress["listing_complete"] = True
+                for future in as_completed(in_flight):
+                    stage(*future.result())
+
+            rows = staging.execute("SELECT thread_id, record FROM staged ORDER BY thread_id, received_at, seq")
+            for thread_id, thread_rows in groupby(rows, key=itemgetter(0)):
+                records = [json.loads(record) for _, record in thread_rows]
+                self.catalog.upsert_conversation(self._write_imported_thread(thread_id, records))
+                progress["threads_done"] += 1
+        finally:
+            staging.close()
+            staging_path.unlink(missing_ok=True)
+
         return {
-            "message": "Update skipped",
+            "message": "Import complete",
+            "sync": "import",
             "data_path": str(self.emails_dir),
-            "conversations": []
+            "messages_imported": progress["messages_parsed"],
+            "messages_failed": progress["messages_failed"],
+            "threads_imported": progress["threads_done"]
         }
+
+    def _write_imported_thread(self, thread_id: str, records: List[Dict]) -> Dict:
+        """Write the parsed messages of one imported thread to its conversation folder."""
+        subject = records[0]["Headers"]["subject"] or 'No Subject'
+        timestamp = datetime.fromtimestamp(records[0]["ReceivedAt"]).strftime("%Y-%m-%d_%H-%M-%S")
+        folder_name = create_safe_folder_name(subject, timestamp)
+        conv_folder = (parent or self.emails_dir) / folder_name
+        conv_folder.mkdir(parents=True, exist_ok=True)
+
+        conversation_data = {
+            "ConversationID": thread_id,
+            "Topic": subject,
+            "Folder": folder_name,
+            "Messages": []
+        }
+        for idx, record in enumerate(records):
+            msg_folder = conv_folder / f"message_{idx+1}"
+            msg_folder.mkdir(parents=True, exist_ok=True)
+            conversation_data["Messages"].append(self._write_message(
+                msg_folder, record["MessageID"], record["Labels"], subject, idx + 1,
+                record["Headers"], record["Text"], record["Html"], record["Attachments"]))
+
+        (conv_folder / "conversation.json").write_text(
+            json.dumps(conversation_data, indent=4, ensure_ascii=False), encoding="utf-8")
+        return conversation_data
@@ -0,0 +1,142 @@
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from ...config.settings import get_settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    vector BLOB NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used);
+"""
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Share of the cache kept when it overflows, so eviction does not run on every insert
+EVICTION_TARGET = 0.9
+
+def normalize_text(text: str) -> str:
+    """Canonical form of a text for cache lookups; whitespace differences do not change the embedding key."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+def embedding_key(model: str, dimensions: Optional[int], text: str) -> str:
+    payload = f"{model}\0{dimensions or 'default'}\0{normalize_text(text)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """SQLite store of computed embeddings, evicting the least recently used past ``max_entries``."""
+
+    def __init__(self, path: Path, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        """Return the cached vectors among ``keys`` and mark them as recently used."""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock, self._conn:
+            # Stay below SQLite's limit on bound parameters
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for key, vector in self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch):
+                    found[key] = array("f", vector).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+        return found
+
+    def put_many(self, vectors: Dict[str, List[float]]) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in vectors.items()])
+            self._count += self._conn.total_changes - before
+            if self._count > self.max_entries:
+                excess = self._count - int(self.max_entries * EVICTION_TARGET)
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,))
+                self._count -= excess
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings that look every text up in an ``EmbeddingCache`` before calling the model.
+
+    Entries are keyed by model, output dimensions and the normalized text,
+    so identical text anywhere (quoted replies, signatures, a shared
+    attachment) is only embedded once, and re-ingesting unchanged content
+    needs no embedding calls at all.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = getattr(embeddings, "model", None) or getattr(embeddings, "model_name", None) \
+            or type(embeddings).__name__
+        self.dimensions = getattr(embeddings, "dimensions", None)
+
+    @classmethod
+    def from_settings(cls, embeddings: Embeddings) -> Embeddings:
+        """Wrap ``embeddings`` in the configured cache, or return them as is when caching is disabled."""
+        settings = get_settings()
+        if settings.embedding_cache_max_entries <= 0:
+            return embeddings
+        return cls(embeddings, EmbeddingCache(Path(settings.embedding_cache_path),
+                                              settings.embedding_cache_max_entries))
+
+    def _lookup(self, texts: List[str]):
+        keys = [embedding_key(self.model, self.dimensions, text) for text in texts]
+        cached = self.cache.get_many(keys)
+        # Each distinct missing text is embedded once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        return keys, cached, missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, cached, missing = self._lookup(texts)
+        if missing:
+            computed = dict(zip(missing, self.embeddings.embed_documents(list(missing.values()))))
+            self.cache.put_many(computed)
+            cached.update(computed)
+        return [cached[key] for key in keys]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, cached, missing = self._lookup(texts)
+        if missing:
+            computed = dict(zip(missing, await self.embeddings.aembed_documents(list(missing.values()))))
+            self.cache.put_many(computed)
+            cached.update(computed)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.embeddings.aembed_query(text)
@@ -0,0 +1,170 @@
+import math
+import time
+import random
+import asyncio
+from typing import List, Optional
+
+import openai
+from langchain_core.embeddings import Embeddings
+
+from ...config.settings import get_settings
+from ...process.tokens import count_tokens
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return isinstance(error, openai.RateLimitError) or getattr(error, "status_code", None) == 429
+
+def is_retryable_error(error: Exception) -> bool:
+    """Check whether a failed embedding request is worth retrying."""
+    if getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES:
+        return True
+    return isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError,
+                              ConnectionError, TimeoutError))
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Delay the API asked for in its Retry-After headers, if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+class _Budget:
+    """Token bucket refilled continuously at ``per_minute`` units a minute."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.level = float(per_minute)
+        self.rate = per_minute / 60
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float) -> float:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        # A request larger than the whole budget waits for a full bucket instead of forever
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.level -= amount
+
+class RateLimitedEmbeddings(Embeddings):
+    """Sends every embedding request through one shared quota and concurrency limit.
+
+    Requests wait for room in the requests-per-minute and tokens-per-minute
+    budgets before they are sent. The number of concurrent requests adapts:
+    it grows by one for every window of successful requests and halves on
+    a 429, up to ``max_concurrency``. Rate-limited and transient failures
+    are retried with jittered exponential backoff, honouring Retry-After.
+    """
+
+    def __init__(self, embeddings: Embeddings, requests_per_minute: int, tokens_per_minute: int,
+                 max_concurrency: int, max_retries: int, backoff: float = 1.0):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", None)
+        self.dimensions = getattr(embeddings, "dimensions", None)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._requests = _Budget(requests_per_minute) if requests_per_minute else None
+        self._tokens = _Budget(tokens_per_minute) if tokens_per_minute else None
+        self._limit = float(self.max_concurrency)
+        self._in_flight = 0
+        self._loop = None
+
+    @classmethod
+    def from_settings(cls, embeddings: Embeddings) -> "RateLimitedEmbeddings":
+        settings = get_settings()
+        return cls(
+            embeddings,
+            requests_per_minute=settings.embedding_requests_per_minute,
+            tokens_per_minute=settings.embedding_tokens_per_minute,
+            max_concurrency=settings.embedding_max_concurrency,
+            max_retries=settings.embedding_max_retries
+        )
+
+    @property
+    def concurrency_limit(self) -> int:
+        return max(1, int(self._limit))
+
+    def _bind_loop(self) -> None:
+        # asyncio primitives belong to one event loop; scripts may run several in turn
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._budget_lock = asyncio.Lock()
+            self._slots = asyncio.Condition()
+            self._in_flight = 0
+
+    async def _reserve(self, requests: int, tokens: int) -> None:
+        async with self._budget_lock:
+            while True:
+                wait = max(self._requests.wait_time(requests) if self._requests else 0.0,
+                           self._tokens.wait_time(tokens) if self._tokens else 0.0)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self._requests:
+                self._requests.take(requests)
+            if self._tokens:
+                self._tokens.take(tokens)
+
+    async def _acquire_slot(self) -> None:
+        async with self._slots:
+            await self._slots.wait_for(lambda: self._in_flight < self.concurrency_limit)
+            self._in_flight += 1
+
+    async def _release_slot(self, rate_limited: bool) -> None:
+        async with self._slots:
+            self._in_flight -= 1
+            if rate_limited:
+                self._limit = max(1.0, self._limit / 2)
+            else:
+                self._limit = min(float(self.max_concurrency), self._limit + 1 / self._limit)
+            self._slots.notify_all()
+
+    async def _call(self, texts: List[str], call):
+        self._bind_loop()
+        tokens = sum(count_tokens(text) for text in texts)
+        # OpenAIEmbeddings splits large inputs into requests of chunk_size texts
+        requests = math.ceil(len(texts) / (getattr(self.embeddings, "chunk_size", None) or len(texts)))
+        attempt = 0
+        while True:
+            await self._reserve(requests, tokens)
+            await self._acquire_slot()
+            rate_limited = False
+            try:
+                return await call()
+            except Exception as e:
+                rate_limited = is_rate_limit_error(e)
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    raise
+                attempt += 1
+                delay = self.backoff * (2 ** (attempt - 1)) + random.uniform(0, self.backoff)
+                delay = max(delay, retry_after(e) or 0.0)
+                print(f"Embedding request failed ({type(e).__name__}), retrying in {delay:.1f}s "
+                      f"(attempt {attempt}/{self.max_retries}, concurrency {self.concurrency_limit})")
+            finally:
+                await self._release_slot(rate_limited)
+            await asyncio.sleep(delay)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return await self._call(texts, lambda: self.embeddings.aembed_documents(texts))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self._call([text], lambda: self.embeddings.aembed_query(text))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
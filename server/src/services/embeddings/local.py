@@ -0,0 +1,116 @@
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from ...config.settings import get_settings
+
+WARM_UP_TEXT = "Warm-up sentence for the embedding model."
+
+class LocalEmbeddings(Embeddings):
+    """Embeddings computed by a sentence-transformers model on this machine.
+
+    Inference runs on one dedicated thread with torch capped at
+    ``threads`` threads, so embedding never competes with itself for the
+    CPU. Async requests that arrive within ``max_wait_ms`` of each other
+    (ingestion batches, chat queries) are merged into a single forward pass
+    of up to ``max_batch_size`` texts.
+    """
+
+    def __init__(self, model_name: str, device: str = "cpu", max_batch_size: int = 32,
+                 max_wait_ms: int = 10, threads: int = 0):
+        self.model = model_name
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.threads = threads
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local-embeddings")
+        self._pending: Deque[Tuple[List[str], asyncio.Future]] = deque()
+        self._pending_texts = 0
+        self._worker: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_settings(cls) -> "LocalEmbeddings":
+        settings = get_settings()
+        return cls(
+            model_name=settings.local_embedding_model,
+            device=settings.local_embedding_device,
+            max_batch_size=settings.local_embedding_batch_size,
+            max_wait_ms=settings.local_embedding_max_wait_ms,
+            threads=settings.local_embedding_threads
+        )
+
+    def _load(self):
+        with self._load_lock:
+            if self._model is None:
+                import torch
+                from sentence_transformers import SentenceTransformer
+                if self.threads:
+                    torch.set_num_threads(self.threads)
+                self._model = SentenceTransformer(self.model, device=self.device)
+            return self._model
+
+    def warm_up(self) -> None:
+        """Load the model and run one inference, so the first real request does not pay for it."""
+        self._executor.submit(self._encode, [WARM_UP_TEXT]).result()
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        vectors = self._load().encode(texts, batch_size=self.max_batch_size,
+                                      normalize_embeddings=True, convert_to_numpy=True)
+        return vectors.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._executor.submit(self._encode, list(texts)).result()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((list(texts), future))
+        self._pending_texts += len(texts)
+        if self._worker is None or self._worker.done() or self._worker.get_loop() is not loop:
+            self._worker = loop.create_task(self._run_batches())
+        return await future
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    async def _run_batches(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            if self._pending_texts < self.max_batch_size:
+                # Give concurrent callers a moment to join this batch
+                await asyncio.sleep(self.max_wait)
+
+            batch, size = [], 0
+            while self._pending and (not batch or size + len(self._pending[0][0]) <= self.max_batch_size):
+                texts, future = self._pending.popleft()
+                self._pending_texts -= len(texts)
+                batch.append((texts, future))
+                size += len(texts)
+
+            try:
+                vectors = await loop.run_in_executor(
+                    self._executor, self._encode, [text for texts, _ in batch for text in texts])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            offset = 0
+            for texts, future in batch:
+                if not future.done():
+                    future.set_result(vectors[offset:offset + len(texts)])
+                offset += len(texts)
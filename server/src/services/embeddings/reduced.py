@@ -0,0 +1,57 @@
+import math
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+# Models trained so that a prefix of their vectors is an embedding of its own (Matryoshka
+# representation learning); truncating vectors of any other model destroys their meaning
+REDUCIBLE_MODEL_PREFIXES = ("text-embedding-3-",)
+
+def supports_reduction(model: str) -> bool:
+    return model.startswith(REDUCIBLE_MODEL_PREFIXES)
+
+def reduce_vector(vector: List[float], dimensions: int) -> List[float]:
+    """First ``dimensions`` components of a vector, scaled back to unit length."""
+    truncated = vector[:dimensions]
+    norm = math.sqrt(sum(x * x for x in truncated))
+    return [x / norm for x in truncated] if norm else list(truncated)
+
+class ReducedEmbeddings(Embeddings):
+    """Embeddings shortened to their first ``dimensions`` components and renormalized.
+
+    text-embedding-3 models are trained so that a prefix of the vector is
+    an embedding in its own right; this is what the API's ``dimensions``
+    parameter computes. Shortening on our side lets indices of different
+    sizes share one dispatcher and cache of full vectors, and makes vectors
+    migrated from a full-size index identical to newly embedded ones.
+    """
+
+    def __init__(self, embeddings: Embeddings, dimensions: int):
+        self.embeddings = embeddings
+        self.dimensions = dimensions
+
+    @classmethod
+    def with_dimensions(cls, embeddings: Embeddings, dimensions: int, full_dimensions: int,
+                        model: str) -> Embeddings:
+        """Embeddings of ``dimensions`` components; the model's own when it is 0 or the full size."""
+        if dimensions > full_dimensions:
+            raise ValueError(f"Cannot use {dimensions} embedding dimensions, the model returns {full_dimensions}")
+        if not dimensions or dimensions == full_dimensions:
+            return embeddings
+        if not supports_reduction(model):
+            raise ValueError(f"Cannot shorten the vectors of {model} to {dimensions} dimensions; "
+                             f"only text-embedding-3 models are trained for it")
+        return cls(embeddings, dimensions)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [reduce_vector(vector, self.dimensions) for vector in self.embeddings.embed_documents(texts)]
+
+    def embed_query(self, text: str) -> List[float]:
+        return reduce_vector(self.embeddings.embed_query(text), self.dimensions)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = await self.embeddings.aembed_documents(texts)
+        return [reduce_vector(vector, self.dimensions) for vector in vectors]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return reduce_vector(await self.embeddings.aembed_query(text), self.dimensions)